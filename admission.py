@@ -0,0 +1,193 @@
+"""Admission control for the analysis page's budget sweeps.
+
+A sweep's cost grows with configs x sun positions x panels, so a wide search
+range with small steps can keep a worker busy for minutes. Before running, the
+cost is estimated from the engine's measured throughput (calibrated once on a
+reference stack, then corrected by the time of every sweep that actually ran)
+and the request is
+
+    run         as requested when it fits the latency budget
+    coarsened   with larger sun/width/spacing/panel steps until it fits
+    rejected    when even the coarsest steps don't fit
+
+On top of that each user (client address) runs one sweep at a time and the
+process runs at most MAX_SWEEPS at once, so threads stay free for the light
+callbacks. Limits are per process (per gunicorn worker). X-Forwarded-For is
+only trusted behind the configured number of proxies (app.py applies
+werkzeug's ProxyFix), otherwise any client could pick a new address per request.
+
+    SOLAR_STACK_ANALYSIS_BUDGET=2     seconds a sweep may take
+    SOLAR_STACK_SWEEPS_PER_USER=1
+    SOLAR_STACK_MAX_SWEEPS=2
+    SOLAR_STACK_PROXY_HOPS=0          reverse proxies in front of the app that set X-Forwarded-For
+"""
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import engine
+import plot_analysis
+from stack import Stack, StackConfig
+
+LATENCY_BUDGET = float(os.environ.get('SOLAR_STACK_ANALYSIS_BUDGET', 2))
+SWEEPS_PER_USER = int(os.environ.get('SOLAR_STACK_SWEEPS_PER_USER', 1))
+MAX_SWEEPS = int(os.environ.get('SOLAR_STACK_MAX_SWEEPS', 2))
+
+# (degree_step, width/spacing step, panel step) multipliers, from the requested steps to the coarsest
+COARSENING = [(1, 1, 1), (1.5, 1, 1), (2, 1, 1), (2, 2, 1), (3, 2, 1), (3, 4, 1), (3, 4, 2)]
+SWEEP_SECONDS = .03  # building the frontier frame and figure
+CORRECTION_WEIGHT = .3  # weight of the newest observed sweep in the correction factor
+CORRECTION_LIMITS = (.01, 10)
+
+BUSY_MESSAGE = "Your previous analysis is still running, try again when it has finished."
+OVERLOADED_MESSAGE = "The server is busy with other analyses, try again in a moment."
+
+
+class CostEstimator:
+    """estimated seconds of a budget sweep: per sweep + configs * (per config + positions * panels * per cell)"""
+
+    def __init__(self):
+        self.config_seconds = None  # stack construction and per call overhead of the engine
+        self.cell_seconds = None  # one sun position on one panel
+        self.correction = 1.0  # observed / estimated time of the sweeps that ran (pruning makes them cheaper)
+        self._lock = threading.Lock()
+
+    def calibrate(self, repeats=20):
+        """time the engine on a reference stack, over a single sun position and a fine grid"""
+        cfg = StackConfig(num_panels=8)
+        timings = []
+        for grid in (engine.SunGrid([45], [180]), engine.SunGrid.from_ranges((90, 270), (0, 90), 2)):
+            grid.folded()  # cached per grid, like the grid of a sweep
+            start = time.perf_counter()
+            for _ in range(repeats):
+                engine.average_power(Stack(cfg), grid)
+            timings.append((time.perf_counter() - start) / repeats)
+        cells = (len(grid.folded()[0]) - 1) * cfg.num_panels
+        self.cell_seconds = max(timings[1] - timings[0], 0) / cells
+        self.config_seconds = timings[0]
+
+    def raw_seconds(self, n_configs, n_positions, max_panels):
+        if self.cell_seconds is None:
+            with self._lock:
+                if self.cell_seconds is None:
+                    self.calibrate()
+        return SWEEP_SECONDS + n_configs * (self.config_seconds + n_positions * max_panels * self.cell_seconds)
+
+    def seconds(self, n_configs, n_positions, max_panels):
+        return self.correction * self.raw_seconds(n_configs, n_positions, max_panels)
+
+    def observe(self, raw_seconds, seconds):
+        """correct future estimates with the measured time of a sweep estimated at raw_seconds"""
+        if raw_seconds <= 0:
+            return
+        ratio = min(max(seconds / raw_seconds, CORRECTION_LIMITS[0]), CORRECTION_LIMITS[1])
+        with self._lock:
+            self.correction += CORRECTION_WEIGHT * (ratio - self.correction)
+
+
+@dataclass
+class Plan:
+    """what to do with an analysis request"""
+    action: str  # 'run', 'coarsen' or 'reject'
+    settings: dict = field(default_factory=dict)  # create_budget_pow_fig step and sun settings to run with
+    seconds: float = 0.0  # estimated seconds with these settings
+    raw_seconds: float = 0.0  # uncorrected estimate, for CostEstimator.observe
+    message: str = ''
+
+
+ESTIMATOR = CostEstimator()
+
+
+def sweep_size(num_range, width_range, spacing_range, settings):
+    """(configs, folded sun positions, max panels) of a budget sweep"""
+    ranges = plot_analysis.budget_ranges(num_range, width_range, spacing_range,
+                                         settings['n_step'], settings['w_step'], settings['s_step'])
+    n_configs = len(ranges['num_panels']) * len(ranges['panel_width']) * len(ranges['panel_spacing'])
+    grid = engine.SunGrid.from_ranges(settings['azimuth_range'], settings['elevation_range'],
+                                      settings['degree_step'])
+    return n_configs, len(grid.folded()[0]), max(ranges['num_panels'], default=0)
+
+
+def coarsened(settings, factors):
+    degree, length, panels = factors
+    return dict(settings,
+                degree_step=int(round(settings['degree_step'] * degree)),
+                w_step=settings['w_step'] * length,
+                s_step=settings['s_step'] * length,
+                n_step=settings['n_step'] * panels)
+
+
+def plan(num_range, width_range, spacing_range, settings, budget=None, estimator=ESTIMATOR):
+    """decide how to run a budget sweep with the given search ranges and ANALYSIS_SETTINGS style settings"""
+    budget = LATENCY_BUDGET if budget is None else budget
+    if None in (*num_range, *width_range, *spacing_range):
+        return Plan('reject', message="Fill in every search range to run the analysis.")
+
+    for factors in COARSENING:
+        candidate = coarsened(settings, factors)
+        raw = estimator.raw_seconds(*sweep_size(num_range, width_range, spacing_range, candidate))
+        seconds = raw * estimator.correction
+        if seconds <= budget:
+            if factors == COARSENING[0]:
+                return Plan('run', candidate, seconds, raw)
+            return Plan('coarsen', candidate, seconds, raw, message=(
+                f"Search range too large for {budget:g} s, coarsened to {candidate['degree_step']} deg sun steps, "
+                f"{candidate['w_step']:g} ft width/spacing steps and {candidate['n_step']} panel steps."))
+
+    requested = estimator.seconds(*sweep_size(num_range, width_range, spacing_range, settings))
+    return Plan('reject', message=(
+        f"Search range too large (about {requested:.0f} s to evaluate, the limit is {budget:g} s), "
+        f"narrow the ranges and try again."))
+
+
+def run(sweep_plan, function, estimator=ESTIMATOR):
+    """call function and feed its time to the estimator when it ran a new sweep (not a cached one)"""
+    import pandas  # noqa: F401 (a first, slow import is not part of the sweep's time)
+    misses = plot_analysis.cached_max_power_budget.cache_info().misses
+    start = time.perf_counter()
+    result = function()
+    if plot_analysis.cached_max_power_budget.cache_info().misses > misses:
+        estimator.observe(sweep_plan.raw_seconds, time.perf_counter() - start)
+    return result
+
+
+class ConcurrencyLimiter:
+    """limits the sweeps running at once, per user and in total"""
+
+    def __init__(self, per_user=SWEEPS_PER_USER, total=MAX_SWEEPS):
+        self.per_user = per_user
+        self.total = total
+        self.running = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, user):
+        """yields None when the sweep may run, otherwise the message to show"""
+        with self._lock:
+            if self.running[user] >= self.per_user:
+                message = BUSY_MESSAGE
+            elif sum(self.running.values()) >= self.total:
+                message = OVERLOADED_MESSAGE
+            else:
+                message = None
+                self.running[user] += 1
+        try:
+            yield message
+        finally:
+            if message is None:
+                with self._lock:
+                    self.running[user] -= 1
+                    if not self.running[user]:
+                        del self.running[user]
+
+
+LIMITER = ConcurrencyLimiter()
+
+
+def user_id():
+    """the client address of the current flask request (set from X-Forwarded-For by ProxyFix behind proxies)"""
+    import flask
+    return flask.request.remote_addr
@@ -0,0 +1,184 @@
+"""Streaming power statistics over a sun sweep, without keeping a row per position.
+
+calc_power(avg=True) only answers the mean. Here sun positions are evaluated in
+batches (engine arrays, the mirror folded grid for level stacks) and folded
+into accumulators, so one pass gives for every config:
+
+    mean, std, min, max    power over the sun positions (W)
+    p<q>                   percentiles from a histogram sketch (lower bin edge, exact for bin_width 1)
+    above_<t>              fraction of the time the power is at least t W
+    shadow_loss            fraction of the unshaded energy lost to shadows
+
+Memory per config is fixed (the histogram bins), however fine the grid is.
+Weighted grids (climatology.py) make every statistic time weighted.
+
+    aggregate.stack_statistics(stack, grid, thresholds=(200,))
+    rows = aggregate.evaluate(base, ranges, grid, thresholds=(200,))
+    aggregate.top(rows, 'p10', 20)   # 20 best configs by their 10th percentile power
+
+    python aggregate.py spec.json --rank p10 --top 20 --threshold 200
+"""
+import argparse
+import heapq
+import itertools
+import json
+
+import numpy as np
+
+import batch
+import engine
+import sweep
+from stats import StreamingStats
+
+DEFAULT_PERCENTILES = (10, 50, 90)
+BATCH_POSITIONS = 1024  # sun positions per array pass
+BATCH_CONFIGS = 256  # configs accumulated together by evaluate
+
+
+class PowerAccumulator:
+    """streaming power statistics of n configs, fed one batch of sun positions at a time
+
+    args:
+        n: number of configs
+        max_power: largest possible power (W), the top of the percentile histogram
+        thresholds: powers (W) to report the fraction of time above
+        bin_width: percentile histogram resolution (W)
+    """
+
+    def __init__(self, n, max_power, thresholds=(), bin_width=1):
+        self.stats = StreamingStats((n,), max_value=max_power, bin_width=bin_width)
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.above = np.zeros((len(self.thresholds), n))
+        self.shadow_energy = np.zeros(n)
+        self.full_energy = np.zeros(n)
+
+    def update(self, power, shadow, area, irradiance, weights):
+        """add a batch: power and shadow area (n, k), panel area (n,), irradiance and weights (k,)"""
+        self.stats.update(power, weights)
+        self.above += (power >= self.thresholds[:, None, None]) @ weights
+        self.shadow_energy += (shadow * irradiance) @ weights
+        self.full_energy += area * (irradiance @ weights)
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """dict of arrays over the configs"""
+        weight = np.where(self.stats.weight > 0, self.stats.weight, 1)
+        result = {'mean': self.stats.mean, 'std': self.stats.std, 'min': self.stats.min, 'max': self.stats.max}
+        for q in percentiles:
+            result[f'p{q:g}'] = self.stats.percentile(q)
+        for threshold, above in zip(self.thresholds, self.above):
+            result[f'above_{threshold:g}'] = above / weight
+        result['shadow_loss'] = self.shadow_energy / np.where(self.full_energy > 0, self.full_energy, 1)
+        return result
+
+
+def position_batches(grid, fold=True, size=BATCH_POSITIONS):
+    """yield (dx, dy, dz, irradiance, weights) batches of the grid
+
+    with fold the mirror folded grid is used, each position weighted by the
+    positions (or grid weight) it stands for
+    """
+    if fold:
+        positions, inverse, counts = grid.folded()
+        weights = counts.astype(float) if grid.weights is None else np.bincount(inverse, grid.weights,
+                                                                                len(positions))
+    else:
+        positions = grid
+        weights = np.ones(len(grid)) if grid.weights is None else grid.weights
+    for start in range(0, len(positions), size):
+        s = slice(start, start + size)
+        yield positions.dx[s], positions.dy[s], positions.dz[s], positions.irradiance[s], weights[s]
+
+
+def stack_statistics(stack, grid, thresholds=(), percentiles=DEFAULT_PERCENTILES, bin_width=1,
+                     batch_positions=BATCH_POSITIONS):
+    """streaming power statistics of a stack over the grid, dict of floats
+
+    a heeled, pitched or turned stack sees the beam at its incidence (see engine.boat_frame)
+    """
+    area = np.array([stack.total_panel_area])
+    incidence = engine.boat_frame(stack, grid.dx, grid.dy, grid.dz)[3]
+    max_power = area[0] * engine.FT2_TO_M2 * stack.eff * np.max(grid.irradiance * incidence, initial=0)
+    accumulator = PowerAccumulator(1, max_power, thresholds, bin_width)
+    for dx, dy, dz, irradiance, weights in position_batches(grid, engine.is_mirror_symmetric(stack),
+                                                            batch_positions):
+        dx, dy, dz, incidence = engine.boat_frame(stack, dx, dy, dz)
+        irradiance = irradiance * incidence  # on the panels
+        shadow = engine.shadow_area(stack, dx, dy, dz)[None, :]
+        power = engine.power_from_area((area[:, None] - shadow) * engine.FT2_TO_M2, irradiance, stack.eff)
+        accumulator.update(power, shadow, area, irradiance, weights)
+    return {name: float(values[0]) for name, values in accumulator.summary(percentiles).items()}
+
+
+def configs_statistics(columns, grid, thresholds=(), percentiles=DEFAULT_PERCENTILES, bin_width=1,
+                       batch_positions=BATCH_POSITIONS):
+    """stack_statistics of many level configs in one pass, dict of arrays over the configs
+
+    columns are arrays over the configs like engine.configs_average_power takes
+    """
+    area = engine.configs_panel_area(columns)
+    eff = np.broadcast_to(np.asarray(columns['eff'], dtype=float), area.shape)
+    max_power = (area * engine.FT2_TO_M2 * eff).max(initial=0) * grid.irradiance.max(initial=0)
+    accumulator = PowerAccumulator(len(area), max_power, thresholds, bin_width)
+    for dx, dy, dz, irradiance, weights in position_batches(grid, size=batch_positions):
+        shadow = engine.configs_shadow_area(columns, dx, dy, dz)
+        power = np.trunc((area[:, None] - shadow) * engine.FT2_TO_M2 * eff[:, None] * irradiance)
+        accumulator.update(power, shadow, area, irradiance, weights)
+    return accumulator.summary(percentiles)
+
+
+def evaluate(base, ranges, grid, thresholds=(), percentiles=DEFAULT_PERCENTILES, bin_width=1, start=0,
+             batch_configs=BATCH_CONFIGS):
+    """lazily yield (index, config, statistics, cost) for every config of the sweep
+
+    like sweep.evaluate, with a dict of statistics instead of the average power.
+    batch_configs configs are accumulated together
+    """
+    configs = sweep.iter_configs(base, ranges, start)
+    while True:
+        chunk = list(itertools.islice(configs, batch_configs))
+        if not chunk:
+            return
+        columns = {name: np.array([getattr(cfg, name) for _, cfg in chunk]) for name in sweep.CONFIG_FIELDS}
+        statistics = configs_statistics(columns, grid, thresholds, percentiles, bin_width)
+        area = engine.configs_panel_area(columns)
+        cost = engine.cost(area, columns['panel_width'], columns['cost_panel'], columns['cost_frame'])
+        for i, (index, cfg) in enumerate(chunk):
+            yield index, cfg, {name: float(values[i]) for name, values in statistics.items()}, int(cost[i])
+
+
+def top(rows, statistic, k=10, lowest=False, max_cost=None):
+    """the k best rows of evaluate by a statistic (or 'cost'), keeps only k rows in memory"""
+    if max_cost is not None:
+        rows = (row for row in rows if row[3] <= max_cost)
+
+    def key(row):
+        return row[3] if statistic == 'cost' else row[2][statistic]
+
+    return (heapq.nsmallest if lowest else heapq.nlargest)(k, rows, key=key)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="rank the configs of a sweep spec by streaming power statistics")
+    parser.add_argument('spec', help="sweep spec json (see batch.py)")
+    parser.add_argument('--rank', default='mean', help="statistic to rank by (mean, min, p10, above_200, ...)")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--lowest', action='store_true', help="rank the lowest values first (e.g. shadow_loss)")
+    parser.add_argument('--threshold', type=float, action='append', default=[], help="report time above this power (W)")
+    parser.add_argument('--percentile', type=float, action='append', help="percentiles to report (default 10, 50, 90)")
+    parser.add_argument('--bin-width', type=float, default=1, help="percentile resolution (W)")
+    parser.add_argument('--max-cost', type=float)
+    args = parser.parse_args(argv)
+
+    spec = batch.load_spec(args.spec)
+    if batch.panel_options(spec):
+        raise SystemExit("aggregate.py evaluates flat rectangular panels, run tilted or outlined panels with batch.py")
+    rows = evaluate(*batch.sweep_setup(spec), args.threshold, args.percentile or DEFAULT_PERCENTILES,
+                    args.bin_width)
+    for index, cfg, statistics, cost in top(rows, args.rank, args.top, args.lowest, args.max_cost):
+        changed = {name: getattr(cfg, name) for name in spec['ranges']}
+        values = {name: round(value, 3) for name, value in statistics.items()}
+        print(json.dumps({'index': index, 'cost': cost, **changed, **values}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Exact shadow geometry over regions of sun angles.
+
+For a pair of panels (same geometry as Stack._update_shadows) the shadow of the
+upper panel lands on the lower panel's plane offset by
+
+    a = x0_upper - c sin(az),   b = -c cos(az),   c = spacing / tan(elevation)
+
+and the shadow area is x_overlap(a) * y_overlap(b), both piecewise linear in
+the offsets. Between the azimuths where a shadow edge crosses a panel edge the
+area is (p + q sin az)(r + w cos az), which integrates over azimuth in closed
+form. Over elevation the result is smooth between the elevations where those
+crossings appear or disappear, so each such piece is integrated with
+Gauss-Legendre quadrature (clustered at the piece ends, where the integrand
+has square root kinks).
+
+Powers here are not truncated to whole watts like Stack.power, so averages are
+the exact continuous mean over the region rather than a grid mean.
+"""
+import math
+
+import numpy as np
+
+import engine
+
+TWO_PI = 2 * np.pi
+
+
+def _pairs(stack):
+    """(x0_upper, upper length, lower x0, lower x1, spacing) for every shading pair"""
+    return [(upper.x0, upper.length, lower.x0, lower.x1, upper.z - lower.z)
+            for lower, upper in zip(stack.panels[:-1], stack.panels[1:])]
+
+
+def _x_breaks(length_upper, x0_lower, x1_lower):
+    """shadow offsets a where the x overlap changes slope"""
+    return np.array([x0_lower - length_upper, x1_lower - length_upper, x0_lower, x1_lower])
+
+
+def _y_breaks(width):
+    """shadow offsets b where the y overlap changes slope"""
+    return np.array([-width, 0.0, width])
+
+
+def _azimuth_breaks(c, x0_upper, x_breaks, y_breaks, theta0, theta1):
+    """sorted azimuths (radians, shape (E, K)) splitting [theta0, theta1] into pieces
+    where both overlaps are linear, padded with theta1 so every row has the same length"""
+    c = c[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sin_values = (x0_upper - x_breaks[None, :]) / c  # sin(az) at x crossings
+        cos_values = -y_breaks[None, :] / c  # cos(az) at y crossings
+        asin = np.arcsin(sin_values)
+        acos = np.arccos(cos_values)
+    base = np.concatenate([asin, np.pi - asin, acos, -acos], axis=1)
+
+    periods = np.arange(math.floor(theta0 / TWO_PI) - 1, math.ceil(theta1 / TWO_PI) + 2)
+    angles = (base[:, :, None] + TWO_PI * periods).reshape(len(c), -1)
+    inside = np.isfinite(angles) & (angles > theta0) & (angles < theta1)
+    angles = np.where(inside, angles, theta1)
+
+    ends = np.broadcast_to([[theta0, theta1]], (len(c), 2))
+    return np.sort(np.concatenate([ends, angles], axis=1), axis=1)
+
+
+def _overlaps(a, b, length_upper, x0_lower, x1_lower, width):
+    """x/y overlap of the shadow at offsets (a, b) and their slopes w.r.t. a and b"""
+    x_overlap = np.maximum(0, np.minimum(a + length_upper, x1_lower) - np.maximum(a, x0_lower))
+    x_slope = np.where(x_overlap > 0, (a + length_upper < x1_lower).astype(float) - (a > x0_lower), 0)
+    y_overlap = np.maximum(0, width - np.abs(b))
+    y_slope = np.where(y_overlap > 0, -np.sign(b), 0)
+    return x_overlap, x_slope, y_overlap, y_slope
+
+
+def _pair_integral(pair, width, c, theta0, theta1):
+    """integral of one pair's shadow area over [theta0, theta1] for every c (ft^2 * rad)"""
+    x0_upper, length_upper, x0_lower, x1_lower, _ = pair
+    x_breaks = _x_breaks(length_upper, x0_lower, x1_lower)
+    angles = _azimuth_breaks(c, x0_upper, x_breaks, _y_breaks(width), theta0, theta1)
+    lo, hi = angles[:, :-1], angles[:, 1:]
+
+    # linear pieces from the piece midpoints: area = (p + q sin)(r + w cos)
+    mid = (lo + hi) / 2
+    c = c[:, None]
+    a, b = x0_upper - c * np.sin(mid), -c * np.cos(mid)
+    x_overlap, x_slope, y_overlap, y_slope = _overlaps(a, b, length_upper, x0_lower, x1_lower, width)
+    p = x_overlap - x_slope * a + x_slope * x0_upper
+    q = -x_slope * c
+    r = y_overlap - y_slope * b
+    w = -y_slope * c
+
+    def antiderivative(theta):
+        sin, cos = np.sin(theta), np.cos(theta)
+        return p * r * theta - q * r * cos + p * w * sin + q * w * sin ** 2 / 2
+
+    return (antiderivative(hi) - antiderivative(lo)).sum(axis=1)
+
+
+def exposed_area_mean(stack, elevations, azimuth_range):
+    """exact mean exposed panel area (ft^2) over the azimuth range, for each elevation (degrees)"""
+    elevations = np.atleast_1d(np.asarray(elevations, dtype=float))
+    theta0, theta1 = np.radians(azimuth_range[0]), np.radians(azimuth_range[1])
+    if theta1 <= theta0:
+        raise ValueError("azimuth range must have a positive width")
+
+    shadow = np.zeros(len(elevations))
+    up = elevations > 0
+    for pair in _pairs(stack):
+        c = pair[4] / np.tan(np.radians(elevations[up]))
+        shadow[up] += _pair_integral(pair, stack.panel_width, c, theta0, theta1)
+
+    return stack.total_panel_area - shadow / (theta1 - theta0)
+
+
+def elevation_breaks(stack, azimuth_range):
+    """elevations (degrees) where a shadow edge crossing appears or leaves the azimuth range
+
+    the exposed area is smooth in elevation between these
+    """
+    ends = np.radians(azimuth_range)
+    c_values = []
+    for x0_upper, length_upper, x0_lower, x1_lower, spacing in _pairs(stack):
+        offsets = x0_upper - _x_breaks(length_upper, x0_lower, x1_lower)
+        crit = [np.abs(offsets), [stack.panel_width]]  # crossings at the sin/cos extremes
+        with np.errstate(divide='ignore'):
+            for theta in ends:  # crossings passing the ends of the azimuth range
+                crit.append(offsets / np.sin(theta))
+                crit.append(-_y_breaks(stack.panel_width) / np.cos(theta))
+        crit = np.concatenate(crit)
+        crit = crit[np.isfinite(crit) & (crit > 0)]
+        c_values.append(np.degrees(np.arctan2(spacing, crit)))
+
+    if not c_values:
+        return np.array([])
+    return np.unique(np.concatenate(c_values))
+
+
+def _nodes(edges, n_nodes):
+    """quadrature nodes/weights over consecutive edge intervals, clustered at the interval ends"""
+    t, weights = np.polynomial.legendre.leggauss(n_nodes)
+    u = (t + 1) / 2
+    x = (1 - np.cos(np.pi * u)) / 2
+    dx = weights / 2 * np.pi / 2 * np.sin(np.pi * u)
+
+    widths = np.diff(edges)[:, None]
+    return (edges[:-1, None] + widths * x).ravel(), (widths * dx).ravel()
+
+
+def average_power(stack, azimuth_range, elevation_range, n_nodes=16, eff=None, model=None):
+    """exact average power (untruncated) over an azimuth x elevation region in degrees
+
+    independent of any degree step. the sun below the horizon counts as zero power,
+    like the elevation 0 row of a calc_power grid. model defaults to the stack's irradiance model
+    """
+    eff = stack.eff if eff is None else eff
+    lo, hi = max(elevation_range[0], 0), elevation_range[1]
+    if hi <= lo:
+        return 0.0
+
+    breaks = elevation_breaks(stack, azimuth_range)
+    edges = np.unique(np.concatenate([[lo, hi], breaks[(breaks > lo) & (breaks < hi)]]))
+    elevations, weights = _nodes(edges, n_nodes)
+
+    exposed = exposed_area_mean(stack, elevations, azimuth_range) * engine.FT2_TO_M2
+    integral = np.sum(weights * exposed * (model or stack.irradiance_model)(elevations))
+    return float(eff * integral / (elevation_range[1] - elevation_range[0]))
+
+
+def shadow_events(stack, elevation, azimuth_range):
+    """azimuths where shadows start, stop or change shape on each panel at one elevation
+
+    returns:
+        list of (lower panel index, azimuth in degrees, event) sorted by azimuth,
+        event is 'start' (shadow appears), 'leave' (shadow disappears) or 'edge'
+        (a shadow edge crosses a panel edge, e.g. the panel becomes fully covered in one direction)
+    """
+    theta0, theta1 = np.radians(azimuth_range[0]), np.radians(azimuth_range[1])
+    if elevation <= 0:
+        return []
+
+    events = []
+    for i, pair in enumerate(_pairs(stack)):
+        x0_upper, length_upper, x0_lower, x1_lower, spacing = pair
+        c = np.array([spacing / np.tan(np.radians(elevation))])
+        angles = _azimuth_breaks(c, x0_upper, _x_breaks(length_upper, x0_lower, x1_lower),
+                                 _y_breaks(stack.panel_width), theta0, theta1)[0]
+        angles = np.unique(angles[(angles > theta0) & (angles < theta1)])
+
+        def shaded(theta):
+            a, b = x0_upper - c * np.sin(theta), -c * np.cos(theta)
+            x_overlap, _, y_overlap, _ = _overlaps(a, b, length_upper, x0_lower, x1_lower, stack.panel_width)
+            return x_overlap * y_overlap > 1e-9
+
+        eps = 1e-7
+        for theta, was, now in zip(angles, shaded(angles - eps), shaded(angles + eps)):
+            if was or now:  # crossings outside the panel don't change anything
+                event = 'start' if not was else 'leave' if not now else 'edge'
+                events.append((i, float(np.degrees(theta)), event))
+
+    return sorted(events, key=lambda event: event[1])
@@ -1,41 +1,92 @@
+import time
+_IMPORT_START = time.perf_counter()
+
+import logging
+import os
+import sys
 import dash
+from dash import html
 from dash.dependencies import Input, Output
 import plotly.graph_objects as go
 import layout as layout
 from stack import Stack, StackConfig
 import plot_interactive
-import plot_analysis
+
+logger = logging.getLogger(__name__)
+
+# lazy mode (default) defers pandas/plotly.express and the first stack until a
+# callback needs them, set SOLAR_STACK_LAZY=0 to load everything at import
+# (useful with gunicorn --preload so forked workers share the loaded modules)
+LAZY = os.environ.get('SOLAR_STACK_LAZY', '1') != '0'
+
+if not LAZY:
+    import pandas  # noqa: F401 (imported for the side effect of loading it up front)
+    import plotly.express  # noqa: F401
+    import plot_analysis  # noqa: F401
+
+# include the mast shadow in the power estimate, using a coarse raster (see occlusion.py)
+MAST_SHADOW = os.environ.get('SOLAR_STACK_MAST_SHADOW', '0') != '0'
+
+# fixed sweep settings of the analysis page
+ANALYSIS_SETTINGS = dict(
+    n_step = 1,
+    w_step = .5,  # ft
+    s_step = .5,  # ft
+    azimuth_range = (90,270),  # front to back (side to side is symmetrical, front to back is not)
+    elevation_range = (15,90),  # start at 15deg for more realistic avg pow
+    degree_step = 10
+)
+
+# stored sweep results (see query.py), analysis requests they cover are answered without a sweep
+RESULT_INDEX_PATH = os.environ.get('SOLAR_STACK_RESULT_INDEX')
+
+STARTUP_TIMES = {}  # phase -> seconds
+STARTUP_TIMES['imports'] = time.perf_counter() - _IMPORT_START
 
 class App:
 
     def __init__(self):
         self.active_stack = None
         self.static_surfaces = None  # contains panels, deck and mast
-        self._create_stack(StackConfig())  # initial stack with default config
+        self.result_index = None
+        if RESULT_INDEX_PATH:
+            import query
+            self.result_index = query.ResultIndex.load(RESULT_INDEX_PATH)
+        if not LAZY:
+            self._create_stack(StackConfig())  # initial stack with default config
         self._initialize_app()
 
     def _initialize_app(self):
         """init app with layout and callbacks"""
         self.app = dash.Dash(__name__)
         self.app.index_string = layout.INDEX_STRING
+        # the layout takes a few ms to build at import, a layout function would not defer it:
+        # Dash calls one as soon as it is assigned, to validate the callbacks against it
         self.app.layout = layout.LAYOUT
         self.setup_callbacks()                           
 
     def _create_stack(self, cfg):
         """create a new active solar panel stack and static surfaces (panels, mast, deck)"""
-        self.active_stack = Stack(cfg)
+        start = time.perf_counter()
+        stack = Stack(cfg)
 
-        panels = self.active_stack.create_panel_surfaces()
+        panels = stack.create_panel_surfaces()
         deck, mast_x = plot_interactive.create_deck(cfg.boat_length, cfg.panel_width)
         cylinder = plot_interactive.create_cylinder(cfg.panel_width, mast_x, 
-                                            height=self.active_stack.mast_height)
+                                            height=stack.mast_height)
 
+        # callbacks use the returned objects, with threaded workers another request
+        # may replace active_stack while this one is still being drawn
+        self.active_stack = stack
         self.static_surfaces = panels + [cylinder] + [deck]
+        STARTUP_TIMES.setdefault('first stack', time.perf_counter() - start)
+        return stack, self.static_surfaces
 
-    def new_fig(self, data):
+    def new_fig(self, data, stack=None):
         """create new plotly fig with correct camera angles and styles"""
-        L = self.active_stack.boat_length
-        W = self.active_stack.panel_width
+        stack = stack or self.active_stack
+        L = stack.boat_length
+        W = stack.panel_width
         D = L*.1 + L*1.1
 
         fig = go.Figure(data)
@@ -62,6 +113,23 @@ class App:
         )        
         return fig
 
+    def sensitivity_table(self, cfg):
+        """table of the change in average power and cost per step of each config field"""
+        import sensitivity
+        rows = sensitivity.config_sensitivity(
+            cfg,
+            ANALYSIS_SETTINGS['azimuth_range'],
+            ANALYSIS_SETTINGS['elevation_range'],
+            ANALYSIS_SETTINGS['degree_step']
+        )
+        header = html.Tr([html.Th('Field'), html.Th('Step'), html.Th('Avg Power (W)'), html.Th('Cost ($)')])
+        body = [
+            html.Tr([html.Td(row['field']), html.Td(f"+{row['step']:g}"),
+                     html.Td(f"{row['power']:+.1f}"), html.Td(f"{row['cost']:+.0f}")])
+            for row in rows
+        ]
+        return html.Table([header] + body)
+
     def setup_callbacks(self):
         """set up dash callbacks for interactive updates"""
 
@@ -79,7 +147,8 @@ class App:
         @self.app.callback(
             [Output('sun-shadow-plot', 'figure'),
              Output('estimated-power', 'children'),
-             Output('estimated-cost', 'children')],
+             Output('estimated-cost', 'children'),
+             Output('sensitivity-table', 'children')],
             [Input('plot-toggle-button', 'n_clicks')],
             [Input('num-panels-input', 'value'),
             Input('panel-spacing-input', 'value'),
@@ -111,28 +180,37 @@ class App:
                 cost_panel=cost_panel,
                 cost_frame=cost_frame
             )
-            self._create_stack(new_config)
+            stack, static_surfaces = self._create_stack(new_config)
             
             if n_clicks % 2 == 0:
                 # update dynamic elements
-                self.active_stack.update_sun_direction_vector(elevation, azimuth)
-                sun_lines = self.active_stack.create_sun_lines()
-                shadows = self.active_stack.create_shadow_surfaces()
-                data = self.static_surfaces + sun_lines + shadows
+                stack.update_sun_direction_vector(elevation, azimuth)
+                sun_lines = stack.create_sun_lines()
+                shadows = stack.create_shadow_surfaces()
+                data = static_surfaces + sun_lines + shadows
+
+                power = stack.power
+                if MAST_SHADOW:
+                    import occlusion
+                    raster = occlusion.RasterOcclusion(stack, occlusion.INTERACTIVE_CELL_SIZE)
+                    power = int(raster.power(elevation, azimuth)[0])
                 
                 return (
-                    self.new_fig(data), 
-                    f"{self.active_stack.power}", 
-                    f'{self.active_stack.cost}'
+                    self.new_fig(data, stack), 
+                    f"{power}", 
+                    f'{stack.cost}',
+                    self.sensitivity_table(new_config)
                 )
             else:
                 # heatmap
-                heatmap = plot_analysis.create_heatmap(self.active_stack)
-                return (heatmap, '', '')
+                import plot_analysis
+                heatmap = plot_analysis.create_heatmap(stack)
+                return (heatmap, '', '', '')
 
       
         @self.app.callback(
-            Output('analysis-plot', 'figure'),
+            [Output('analysis-plot', 'figure'),
+             Output('analysis-message', 'children')],
             [Input('panel-num-min', 'value'),
             Input('panel-num-max', 'value'),
             Input('panel-spacing-min', 'value'),
@@ -169,27 +247,75 @@ class App:
                 cost_frame = cost_frame
             )
 
-            budget_pow_fig = plot_analysis.create_budget_pow_fig(
-                config = config,
+            import admission
+            import plot_analysis
+            import response_cache
+            ranges = dict(
                 num_range = (num_min, num_max),
                 width_range = (width_min, width_max),  # ft
                 spacing_range = (space_min, space_max),  # ft
-                n_step = 1,  
-                w_step = .5,  # ft
-                s_step = .5,  # ft
-                azimuth_range = (90,270),  # front to back (side to side is symmetrical, front to back is not)
-                elevation_range = (15,90),  # start at 15deg for more realistic avg pow
-                degree_step = 10
             )
-            return budget_pow_fig
+            if self.result_index is not None:
+                rows = self.result_index.analysis_rows(config, **ranges, **ANALYSIS_SETTINGS)
+                if rows is not None:
+                    return plot_analysis.pow_budget_fig(self.result_index.budget_frontier(rows)), ''
+
+            plan = admission.plan(**ranges, settings=ANALYSIS_SETTINGS)
+            if plan.action != 'run':
+                # coarsened steps and rejections follow the latency budget and the measured
+                # sweep times, the same request may get a different answer later
+                response_cache.uncacheable()
+            if plan.action == 'reject':
+                return dash.no_update, plan.message
+
+            with admission.LIMITER.slot(admission.user_id()) as busy:
+                if busy:
+                    response_cache.uncacheable()  # the same request may run later
+                    return dash.no_update, busy
+                budget_pow_fig = admission.run(plan, lambda: plot_analysis.create_budget_pow_fig(
+                    config = config,
+                    **ranges,
+                    **plan.settings
+                ))
+            return budget_pow_fig, plan.message
 
 
     def run(self):
         self.app.run_server(debug=False)
-        
 
+
+def startup_report():
+    """return a text report of time spent in each startup phase"""
+    lines = [f"{phase:<12}{secs * 1000:9.1f} ms" for phase, secs in STARTUP_TIMES.items()]
+    heavy = [mod for mod in ('pandas', 'plotly.express') if mod in sys.modules]
+    lines.append(f"mode        {'lazy' if LAZY else 'eager'}")
+    lines.append(f"heavy mods  {', '.join(heavy) if heavy else 'none'}")
+    return '\n'.join(lines)
+
+
+_app_start = time.perf_counter()
 solar_app = App()
 server = solar_app.app.server
+# behind reverse proxies, take the client address from the hops they add to X-Forwarded-For
+# (admission.py limits sweeps per client), the header of a direct client is never trusted
+PROXY_HOPS = int(os.environ.get('SOLAR_STACK_PROXY_HOPS', 0))
+if PROXY_HOPS:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    server.wsgi_app = ProxyFix(server.wsgi_app, x_for=PROXY_HOPS)
+if os.environ.get('SOLAR_STACK_RESPONSE_CACHE', '1') != '0':
+    import response_cache
+    response_cache.install(server)
+STARTUP_TIMES['app init'] = time.perf_counter() - _app_start
+
+if os.environ.get('SOLAR_STACK_WARMUP', '0') != '0':
+    import warmup
+    _warmup_start = time.perf_counter()
+    warmup.warm_up(warmup.configs_from_env(), ANALYSIS_SETTINGS)
+    STARTUP_TIMES['warm-up'] = time.perf_counter() - _warmup_start
+STARTUP_TIMES['total'] = time.perf_counter() - _IMPORT_START
+
+if os.environ.get('SOLAR_STACK_STARTUP_REPORT', '0') != '0':
+    logger.warning("startup report (pid %s)\n%s", os.getpid(), startup_report())
 
 if __name__ == '__main__':
     solar_app.run()
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""Boat attitude (heel, pitch, heading) and Monte Carlo power over sea states.
+
+Angles are degrees. heel rolls the boat about its length (x) axis, pitch
+tips it about the sideways (y) axis (both right-handed), heading turns it
+about the vertical axis. A sun azimuth is relative to the bow at heading 0,
+so with heading h the sun at azimuth az is at az - h relative to the boat.
+The stack geometry stays in the boat frame, so an attitude is applied by
+rotating the sun vector from the world frame into the boat frame.
+"""
+import numpy as np
+
+import engine
+from stats import StreamingStats
+
+
+def attitude_matrix(heel=0, pitch=0, heading=0):
+    """rotation(s) taking world vectors into the boat frame, shape broadcast(angles) + (3, 3)"""
+    heel, pitch, heading = np.broadcast_arrays(*(np.radians(angle) for angle in (heel, pitch, heading)))
+    ch, sh = np.cos(heel), np.sin(heel)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(heading), np.sin(heading)
+    one, zero = np.ones_like(ch), np.zeros_like(ch)
+
+    def matrix(rows):
+        return np.moveaxis(np.array(rows), (0, 1), (-2, -1))
+
+    # boat -> world is yaw(heading) @ pitch @ roll(heel), world -> boat is its transpose.
+    # heading turns clockwise seen from above, the same way sun azimuths increase
+    roll = matrix([[one, zero, zero], [zero, ch, -sh], [zero, sh, ch]])
+    tip = matrix([[cp, zero, sp], [zero, one, zero], [-sp, zero, cp]])
+    yaw = matrix([[cy, sy, zero], [-sy, cy, zero], [zero, zero, one]])
+    return np.swapaxes(yaw @ tip @ roll, -1, -2)
+
+
+def to_boat_frame(dx, dy, dz, heel=0, pitch=0, heading=0):
+    """rotate world frame sun vector components into the boat frame, vectorized over vectors and angles"""
+    vectors = np.stack(np.broadcast_arrays(dx, dy, dz), axis=-1)[..., None]
+    rotated = (attitude_matrix(heel, pitch, heading) @ vectors)[..., 0]
+    return rotated[..., 0], rotated[..., 1], rotated[..., 2]
+
+
+def power(stack, elevations, azimuths, heel=0, pitch=0, heading=0, model=None):
+    """truncated stack power for arrays of sun positions and attitudes (broadcast together)
+
+    the beam hits the panels at the boat frame sun height instead of sin(elevation),
+    and gives nothing once the sun is behind the panels
+    """
+    elevations = np.asarray(elevations, dtype=float)
+    dx, dy, dz = to_boat_frame(*engine.sun_direction(elevations, azimuths), heel, pitch, heading)
+    model = model or stack.irradiance_model
+
+    up = elevations > 0
+    sin_elev = np.where(up, np.sin(np.radians(elevations)), 1)
+    beam = model(elevations) / sin_elev  # irradiance on a panel facing the sun
+    incidence = np.maximum(dz, 0)
+
+    exposed = (stack.total_panel_area - engine.shadow_area(stack, dx, dy, dz)) * engine.FT2_TO_M2
+    return np.trunc(exposed * stack.eff * beam * incidence)
+
+
+def monte_carlo_power(stack, elevations, azimuths, n_samples=2000, heel_mean=0, heel_sd=5,
+                      pitch_sd=2, heading=0, percentiles=(5, 50, 95), seed=None,
+                      max_batch_elements=2 ** 18, model=None, max_bins=None):
+    """power statistics over random heel/pitch states at every sun position
+
+    heel ~ N(heel_mean, heel_sd) and pitch ~ N(0, pitch_sd), sampled per position.
+    samples are evaluated in batches of arrays and folded into streaming statistics,
+    so memory does not grow with n_samples. max_bins caps the percentile histogram
+    per position (see StreamingStats) on fine grids.
+
+    returns:
+        dict of arrays (one value per sun position): count, mean, std, min, max and p<q> per percentile
+    """
+    elevations, azimuths = np.broadcast_arrays(np.atleast_1d(np.asarray(elevations, dtype=float)),
+                                               np.atleast_1d(np.asarray(azimuths, dtype=float)))
+    rng = np.random.default_rng(seed)
+    model = model or stack.irradiance_model
+
+    # no sample can beat the whole stack facing the sun at the strongest beam
+    up = elevations > 0
+    beam = model(elevations) / np.where(up, np.sin(np.radians(elevations)), 1)
+    max_power = stack.total_panel_area * engine.FT2_TO_M2 * stack.eff * beam.max(initial=0)
+    stats = StreamingStats(elevations.shape, max_value=max_power, max_bins=max_bins)
+
+    batch = max(1, max_batch_elements // elevations.size)
+    done = 0
+    while done < n_samples:
+        k = min(batch, n_samples - done)
+        heel = rng.normal(heel_mean, heel_sd, size=elevations.shape + (k,))
+        pitch = rng.normal(0, pitch_sd, size=elevations.shape + (k,))
+        powers = power(stack, elevations[..., None], azimuths[..., None], heel, pitch, heading, model)
+        stats.update(powers)
+        done += k
+
+    return stats.summary(percentiles)
@@ -0,0 +1,237 @@
+"""Headless batch runner for large design sweeps.
+
+Evaluates every config of a sweep spec in parallel and streams rows to CSV or
+Parquet in fixed size batches, so memory stays bounded no matter how many
+configs there are. After every batch a checkpoint is written next to the
+output, rerunning with --resume continues after the last finished batch.
+
+    python batch.py spec.json -o results.csv --workers 8
+    python batch.py spec.json -o results.parquet --format parquet --resume
+
+spec.json:
+    {
+        "base": {"boat_length": 36},
+        "ranges": {"num_panels": {"start": 3, "stop": 7},
+                   "panel_width": {"start": 1, "stop": 2.5, "step": 0.5},
+                   "boat_length": [30, 36, 44]},
+        "azimuth_range": [90, 270],
+        "elevation_range": [15, 90],
+        "degree_step": 10
+    }
+
+optional "latitude", "season" and "heading" weigh the sun positions by how often
+the sun is there (see climatology.py) instead of equally. optional "roll",
+"pitch" (degrees) and "outline" (convex [u, v] vertices in units of the panel
+length/width) tilt and reshape every panel (see polygons.py).
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from dataclasses import astuple
+
+import climatology
+import engine
+import sweep
+from stack import StackConfig
+
+SUN_DEFAULTS = dict(azimuth_range=(90, 270), elevation_range=(15, 90), degree_step=10)
+COLUMNS = ['index'] + sweep.CONFIG_FIELDS + ['power', 'cost']
+PANEL_OPTIONS = ('roll', 'pitch', 'outline')  # passed on to sweep.evaluate
+
+_worker = {}  # sweep state of a worker process, set by _init_worker
+
+
+def load_spec(path):
+    """read a sweep spec file and fill in the defaults"""
+    with open(path) as f:
+        spec = json.load(f)
+    spec.setdefault('base', {})
+    spec.setdefault('ranges', {})
+    for key, value in SUN_DEFAULTS.items():
+        spec.setdefault(key, value)
+    sweep.expand_ranges(spec['ranges'])  # fail early on unknown fields
+    return spec
+
+
+def spec_hash(spec):
+    """stable hash of a spec, a checkpoint is only resumed for the spec that wrote it"""
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def panel_options(spec):
+    """the spec's roll/pitch/outline, empty for the flat rectangular panels of Stack"""
+    return {key: spec[key] for key in PANEL_OPTIONS if spec.get(key) is not None}
+
+
+def sweep_setup(spec):
+    """(base config, ranges, sun grid) of a spec, the grid is climatology weighted when it has a latitude"""
+    sun_ranges = [spec[key] for key in SUN_DEFAULTS]
+    if spec.get('latitude') is None:
+        grid = engine.SunGrid.from_ranges(*sun_ranges)
+    else:
+        grid = climatology.weighted_grid(*sun_ranges, spec['latitude'], spec.get('season', 'year'),
+                                         spec.get('heading'))
+    return StackConfig(**spec['base']), spec['ranges'], grid
+
+
+def sweep_rows(base, ranges, grid, start, count, **panels):
+    """output rows of count configs of the sweep, from index start (panels as in panel_options)"""
+    results = sweep.evaluate(base, ranges, grid, start=start, **panels)
+    return [(index,) + astuple(cfg) + (power, cost)
+            for index, cfg, power, cost in itertools.islice(results, count)]
+
+
+def _init_worker(spec):
+    _worker['setup'] = sweep_setup(spec)
+    _worker['panels'] = panel_options(spec)
+
+
+def evaluate(unit):
+    """evaluate a (start, count) slice of the sweep into output rows"""
+    start, count = unit
+    return sweep_rows(*_worker['setup'], start, count, **_worker['panels'])
+
+
+class CsvSink:
+    """append rows to a single csv file, resumable by truncating to the checkpointed size"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def open(self, state=None):
+        if state is None:
+            self.file = open(self.path, 'w', newline='')
+            csv.writer(self.file).writerow(COLUMNS)
+        else:
+            self.file = open(self.path, 'r+', newline='')
+            self.file.truncate(state['size'])  # drop rows written after the checkpoint
+            self.file.seek(state['size'])
+        self.writer = csv.writer(self.file)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def state(self):
+        return {'size': self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """write each batch as a part file of a parquet dataset directory"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("parquet output needs pyarrow (pip install pyarrow)")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.parts = 0
+
+    def open(self, state=None):
+        os.makedirs(self.path, exist_ok=True)
+        self.parts = state['parts'] if state else 0
+        # remove parts written after the checkpoint (or left over from an earlier run)
+        for name in os.listdir(self.path):
+            if name.startswith('part-') and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(self.path, name))
+
+    def write(self, rows):
+        table = self.pa.Table.from_pylist([dict(zip(COLUMNS, row)) for row in rows])
+        self.pq.write_table(table, os.path.join(self.path, f"part-{self.parts:05d}.parquet"))
+        self.parts += 1
+
+    def state(self):
+        return {'parts': self.parts}
+
+    def close(self):
+        pass
+
+
+def read_checkpoint(path, spec_id):
+    """return the saved checkpoint for this spec, or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['spec'] != spec_id:
+        raise SystemExit(f"checkpoint {path} belongs to a different spec, remove it or drop --resume")
+    return checkpoint
+
+
+def write_checkpoint(path, checkpoint):
+    """atomically replace the checkpoint file"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def run(spec, output, fmt='csv', workers=None, batch_size=4096, resume=False, log=sys.stderr):
+    """run a sweep spec, streaming rows to output
+
+    returns:
+        number of configs evaluated by this call (excluding resumed ones)
+    """
+    spec_id = spec_hash(spec)
+    checkpoint_path = output.rstrip('/') + '.checkpoint.json'
+    checkpoint = read_checkpoint(checkpoint_path, spec_id) if resume else None
+
+    sink = ParquetSink(output) if fmt == 'parquet' else CsvSink(output)
+    sink.open(checkpoint['sink'] if checkpoint else None)
+    done = checkpoint['next_index'] if checkpoint else 0
+
+    total = sweep.sweep_size(spec['ranges'])
+    workers = workers or os.cpu_count()
+    unit_size = max(1, batch_size // (4 * workers))
+
+    evaluated = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(spec,)) as pool:
+        while done < total:
+            batch_end = min(done + batch_size, total)
+            units = [(i, min(unit_size, batch_end - i)) for i in range(done, batch_end, unit_size)]
+            rows = [row for unit_rows in pool.map(evaluate, units) for row in unit_rows]
+            sink.write(rows)
+
+            done += len(rows)
+            evaluated += len(rows)
+            write_checkpoint(checkpoint_path, {'spec': spec_id, 'next_index': done, 'sink': sink.state()})
+
+            rate = evaluated / (time.perf_counter() - start)
+            print(f"{done}/{total} configs ({rate:.0f}/s)", file=log)
+    sink.close()
+    return evaluated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run a stack design sweep without the UI")
+    parser.add_argument('spec', help="sweep spec json file")
+    parser.add_argument('-o', '--output', required=True, help="csv file or parquet directory")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=None,
+                        help="output format (default from the output extension)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cpus)")
+    parser.add_argument('--batch-size', type=int, default=4096, help="configs per written batch / checkpoint")
+    parser.add_argument('--resume', action='store_true', help="continue from the last checkpoint")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('parquet' if args.output.rstrip('/').endswith('.parquet') else 'csv')
+    run(load_spec(args.spec), args.output, fmt=fmt, workers=args.workers,
+        batch_size=args.batch_size, resume=args.resume)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Sun position climatology: how often the sun is where, per latitude band and season.
+
+calc_power weighs every (azimuth, elevation) cell of its grid equally, including
+sun positions a boat hardly ever sees. Here the sun is followed through every
+day of a season, every few minutes, at several latitudes of a band (vectorized
+solar geometry), and the daylight positions are binned into a 1 degree
+(elevation x azimuth) histogram of time fractions. Histograms are cached per
+(band, season) and kept as float32.
+
+A grid built with weighted_grid() carries the histogram mass that falls on each
+of its cells as weights, so every average over it (engine.average_power,
+sweep.evaluate, ...) becomes the time weighted average, still with one grid
+evaluation per config:
+
+    grid = climatology.weighted_grid((90, 270), (15, 90), 10, latitude=35, season='summer')
+    engine.average_power(stack, grid)
+
+Azimuths of the grid are boat azimuths like everywhere else (bow at 90, stern
+at 270). heading=None assumes the boat points every way equally often, which
+spreads each elevation evenly over azimuth; a fixed heading (compass bearing of
+the bow) turns the sun's compass azimuths into boat azimuths, e.g. heading 0
+puts the noon sun of the northern hemisphere astern at 270.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+import engine
+
+BAND_WIDTH = 10  # degrees of latitude per band
+LATITUDE_SAMPLES = 5  # latitudes evaluated per band
+MINUTE_STEP = 10  # minutes between sun positions through the day
+# northern hemisphere days of the year, the southern hemisphere is shifted by half a year
+SEASONS = {
+    'year': np.arange(1, 366),
+    'winter': np.r_[335:366, 1:60],
+    'spring': np.arange(60, 152),
+    'summer': np.arange(152, 244),
+    'autumn': np.arange(244, 335),
+}
+
+
+def declination(days):
+    """solar declination (degrees) for days of the year (Cooper)"""
+    return 23.44 * np.sin(2 * np.pi * (284 + np.asarray(days)) / 365)
+
+
+def sun_position(latitudes, days, hour_angles):
+    """(elevations, azimuths) in degrees for broadcast arrays of latitude, day of year and hour angle
+
+    azimuths are compass bearings (0 north, 90 east), hour angle 0 is solar noon
+    """
+    phi = np.radians(latitudes)
+    delta = np.radians(declination(days))
+    h = np.radians(hour_angles)
+
+    sin_elev = np.sin(phi) * np.sin(delta) + np.cos(phi) * np.cos(delta) * np.cos(h)
+    elevations = np.degrees(np.arcsin(np.clip(sin_elev, -1, 1)))
+    azimuths = np.degrees(np.arctan2(-np.cos(delta) * np.sin(h),
+                                     np.sin(delta) * np.cos(phi) - np.cos(delta) * np.sin(phi) * np.cos(h)))
+    return elevations, azimuths % 360
+
+
+def band_of(latitude):
+    """index of the latitude band holding |latitude|"""
+    return min(int(abs(latitude) // BAND_WIDTH), 90 // BAND_WIDTH - 1)
+
+
+@lru_cache(maxsize=None)
+def histogram(band, season='year', southern=False):
+    """(90, 360) float32 time fractions of the sun in each 1 degree (elevation, compass azimuth) bin
+
+    bin [e, a] holds elevations in [e, e + 1) and azimuths in [a, a + 1), only daylight counts,
+    so the histogram sums to the fraction of the time the sun is up
+    """
+    if season not in SEASONS:
+        raise ValueError(f"unknown season {season!r}, choose from {', '.join(SEASONS)}")
+    latitudes = band * BAND_WIDTH + (np.arange(LATITUDE_SAMPLES) + .5) * BAND_WIDTH / LATITUDE_SAMPLES
+    if southern:
+        latitudes = -latitudes
+    days = (SEASONS[season] - 1 + (182 if southern else 0)) % 365 + 1
+    hour_angles = np.arange(-180, 180, MINUTE_STEP / 4)  # the sun moves 15 degrees per hour
+
+    elevations, azimuths = sun_position(latitudes[:, None, None], days[None, :, None], hour_angles[None, None, :])
+    up = elevations > 0
+    bins = np.minimum(elevations[up].astype(int), 89) * 360 + np.minimum(azimuths[up].astype(int), 359)
+    counts = np.bincount(bins, minlength=90 * 360).reshape(90, 360)
+    fractions = (counts / elevations.size).astype(np.float32)
+    fractions.setflags(write=False)  # shared between callers
+    return fractions
+
+
+def grid_weights(grid, latitude, season='year', heading=None):
+    """histogram mass on each position of a regular grid (each position stands for the cell around it)"""
+    counts = histogram(band_of(latitude), season, latitude < 0).astype(float)
+    if heading is None:
+        counts = np.repeat(counts.sum(axis=1, keepdims=True) / 360, 360, axis=1)
+    else:
+        # compass bearing - heading is the bearing from the bow, the bow is at boat azimuth 90
+        counts = np.roll(counts, 90 - int(round(heading)), axis=1)
+
+    def nearest(values, centers, period=None):
+        """index of the nearest grid value for every bin center, -1 when outside the grid's cells"""
+        values = np.unique(values)
+        step = np.diff(values).min() if len(values) > 1 else 1
+        distance = np.abs(centers[:, None] - values[None, :])
+        if period:
+            distance = np.minimum(distance, period - distance)
+        index = distance.argmin(axis=1)
+        return np.where(distance[np.arange(len(centers)), index] <= step / 2, index, -1), values
+
+    elevation_index, elevation_values = nearest(grid.elevations, np.arange(90) + .5)
+    azimuth_index, azimuth_values = nearest(grid.azimuths % 360, np.arange(360) + .5, period=360)
+
+    # mass per (elevation value, azimuth value) cell, then looked up for every grid position
+    cells = np.zeros((len(elevation_values), len(azimuth_values)))
+    e, a = np.meshgrid(elevation_index, azimuth_index, indexing='ij')
+    inside = (e >= 0) & (a >= 0)
+    np.add.at(cells, (e[inside], a[inside]), counts[inside])
+
+    # positions sharing a cell (e.g. azimuths 0 and 360) split its mass
+    position_cells = (np.searchsorted(elevation_values, grid.elevations),
+                      np.searchsorted(azimuth_values, grid.azimuths % 360))
+    shared = np.zeros(cells.shape)
+    np.add.at(shared, position_cells, 1)
+    return cells[position_cells] / shared[position_cells]
+
+
+def weighted_grid(azimuth_range, elevation_range, degree_step, latitude, season='year', heading=None,
+                  model=None):
+    """SunGrid.from_ranges with climatology weights, averages over it are time weighted"""
+    grid = engine.SunGrid.from_ranges(azimuth_range, elevation_range, degree_step, model)
+    weights = grid_weights(grid, latitude, season, heading)
+    if not weights.sum():
+        raise ValueError(f"the sun never reaches the grid at latitude {latitude} in {season}")
+    return engine.SunGrid(grid.elevations, grid.azimuths, grid.model, weights)
@@ -0,0 +1,277 @@
+"""Vectorized evaluation of a Stack over many sun positions at once.
+
+Mirrors the scalar path (Stack.update_sun_direction_vector -> Stack.power) with
+numpy arrays, one array element per sun position, so a whole sun sweep is a
+handful of array operations instead of a Python loop per position. A stack
+with heel/pitch/heading (see attitude.py) has the sun rotated into its boat
+frame and the beam scaled by its incidence on the tilted panels, like
+Stack.power does.
+"""
+import numpy as np
+
+import irradiance
+
+FT2_TO_M2 = 0.092903
+MODEL_VERSION = 1  # bump when a change to the geometry or power model changes results
+
+
+def sun_direction(elevations, azimuths):
+    """sun direction vector components for arrays of sun angles (degrees)"""
+    theta = np.radians(azimuths)
+    phi = np.radians(elevations)
+    return np.cos(phi) * np.sin(theta), np.cos(phi) * np.cos(theta), np.sin(phi)
+
+
+def mirror_azimuth(azimuth):
+    """map azimuths onto [90, 270], the fundamental domain of a stack symmetric about the boat centerline
+
+    az and 180 - az only differ in the sign of the sideways sun component, so a
+    mirror symmetric stack has the same power at both
+    """
+    if np.ndim(azimuth) == 0:
+        return azimuth if 90 <= azimuth % 360 <= 270 else (180 - azimuth) % 360
+    folded = azimuth % 360
+    return np.where((folded >= 90) & (folded <= 270), azimuth, (180 - azimuth) % 360)
+
+
+def is_mirror_symmetric(stack):
+    """True when every panel is centered on the same line along the boat and the boat isn't heeled or turned"""
+    if stack.heel != 0 or stack.heading != 0:
+        return False
+    return len({(panel.y0 + panel.y1) / 2 for panel in stack.panels}) <= 1
+
+
+def solar_irradiance(elevations, model=None):
+    """array version of Stack.solar_irradiance, 0 for elevations <= 0"""
+    return (model or irradiance.DEFAULT_MODEL)(elevations)
+
+
+class SunGrid:
+    """sun positions of a sweep with their direction vectors and irradiance
+
+    positions are ordered like calc_power (azimuth outer, elevation inner). the
+    grid only depends on the sun ranges and the irradiance model, so one grid is
+    shared by every stack of a sweep. the vectorized paths take irradiance from
+    the grid's model (Stack.irradiance_model is only used by the scalar path).
+    averages over the grid weigh every position equally unless the grid has
+    weights (e.g. how often the sun is there, see climatology.py).
+    """
+
+    def __init__(self, elevations, azimuths, model=None, weights=None):
+        self.elevations = np.asarray(elevations, dtype=float)
+        self.azimuths = np.asarray(azimuths, dtype=float)
+        self.model = model or irradiance.DEFAULT_MODEL
+        self.weights = None if weights is None else np.asarray(weights, dtype=float) / np.sum(weights)
+        self.dx, self.dy, self.dz = sun_direction(self.elevations, self.azimuths)
+        self.irradiance = self.model(self.elevations)
+
+    @classmethod
+    def from_ranges(cls, azimuth_range, elevation_range, degree_step, model=None):
+        """grid with the same positions as calc_power for these ranges"""
+        azimuths = np.arange(azimuth_range[0], azimuth_range[1] + 1, degree_step)
+        elevations = np.arange(elevation_range[0], elevation_range[1] + 1, degree_step)
+        az, el = np.meshgrid(azimuths, elevations, indexing='ij')
+        return cls(el.ravel(), az.ravel(), model)
+
+    def __len__(self):
+        return len(self.elevations)
+
+    def mean(self, values):
+        """average of values over the positions (last axis), weighted if the grid has weights"""
+        values = np.asarray(values)
+        return values.mean(axis=-1) if self.weights is None else values @ self.weights
+
+    def folded(self):
+        """(fundamental grid, inverse, counts) of the positions mirrored onto [90, 270]
+
+        values on the full grid are values_on_fundamental[inverse], counts are the
+        number of full grid positions each fundamental position stands for
+        """
+        if not hasattr(self, '_folded'):
+            positions = np.stack([self.elevations, mirror_azimuth(self.azimuths)], axis=1)
+            unique, inverse, counts = np.unique(positions, axis=0, return_inverse=True, return_counts=True)
+            self._folded = SunGrid(unique[:, 0], unique[:, 1], self.model), inverse.ravel(), counts
+        return self._folded
+
+
+def boat_frame(stack, dx, dy, dz):
+    """(dx, dy, dz, incidence): world frame sun vectors in the stack's boat frame
+
+    incidence is the beam on the panels relative to a level panel, the boat frame
+    sun height / sin(elevation) and 0 once the sun is behind the panels. a level
+    stack gets its vectors back with incidence 1
+    """
+    if stack.heel == 0 and stack.pitch == 0 and stack.heading == 0:
+        return dx, dy, dz, 1
+    import attitude  # attitude imports engine
+    boat_dx, boat_dy, boat_dz = attitude.to_boat_frame(dx, dy, dz, stack.heel, stack.pitch, stack.heading)
+    dz = np.asarray(dz)
+    return boat_dx, boat_dy, boat_dz, np.maximum(boat_dz, 0) / np.where(dz > 0, dz, 1)
+
+
+def shadow_area(stack, dx, dy, dz):
+    """total shadow area (ft^2) on the stack for arrays of boat frame sun direction components
+
+    same geometry as Stack._update_shadows: each panel shades the one below it.
+    positions with the sun at or below the horizon get no shadow.
+    """
+    dx, dy, dz = np.broadcast_arrays(dx, dy, dz)
+    up = dz > 0
+    dz = np.where(up, dz, 1)
+    total = np.zeros(dz.shape)
+
+    for lower, upper in zip(stack.panels[:-1], stack.panels[1:]):
+        t = (lower.z - upper.z) / dz
+        sx0 = upper.x0 + t * dx
+        sy0 = upper.y0 + t * dy
+        sx1 = sx0 + (upper.x1 - upper.x0)
+        sy1 = sy0 + stack.panel_width
+
+        x0 = np.maximum(sx0, lower.x0)
+        y0 = np.maximum(sy0, lower.y0)
+        x1 = np.minimum(sx1, lower.x1)
+        y1 = np.minimum(sy1, lower.y1)
+
+        overlap = (x0 < x1) & (y0 < y1) & up
+        total += np.where(overlap, (x1 - x0) * (y1 - y0), 0)
+
+    return total
+
+
+def exposed_area_at(stack, dx, dy, dz):
+    """unshaded panel area (m^2) for arrays of world frame sun direction components
+
+    for a heeled, pitched or turned stack the area is scaled by the incidence (see
+    boat_frame), so power is still area * eff * irradiance
+    """
+    dx, dy, dz, incidence = boat_frame(stack, dx, dy, dz)
+    return (stack.total_panel_area - shadow_area(stack, dx, dy, dz)) * FT2_TO_M2 * incidence
+
+
+def exposed_area(stack, grid):
+    """unshaded panel area (m^2) at every position of the grid (see exposed_area_at)
+
+    for a mirror symmetric stack only the positions in the fundamental domain are
+    evaluated and the results are mirrored to the rest of the grid
+    """
+    if is_mirror_symmetric(stack):
+        fundamental, inverse, _ = grid.folded()
+        if len(fundamental) < len(grid):
+            return exposed_area_at(stack, fundamental.dx, fundamental.dy, fundamental.dz)[inverse]
+    return exposed_area_at(stack, grid.dx, grid.dy, grid.dz)
+
+
+def power(stack, grid, eff=None):
+    """Stack.power at every position of the grid
+
+    eff defaults to the stack efficiency, an array of efficiencies returns one
+    row of powers per efficiency (geometry is only evaluated once)
+    """
+    eff = stack.eff if eff is None else eff
+    area = exposed_area(stack, grid)
+    return power_from_area(area, grid.irradiance, eff)
+
+
+def power_from_area(area, irradiance, eff):
+    """truncated power from exposed area and irradiance, one row per efficiency if eff is an array"""
+    eff = np.asarray(eff, dtype=float)
+    return np.trunc(area * eff[..., None] * irradiance)
+
+
+def average_power(stack, grid, eff=None):
+    """average power over the grid, same as calc_power(..., avg=True)"""
+    return grid.mean(power(stack, grid, eff))
+
+
+def panel_area(num_panels, panel_spacing, panel_width, boat_length, base_mast_offset,
+               base_length, mast_h_boat_l_ratio):
+    """total panel area (ft^2) straight from config values, vectorized over configs
+
+    same arithmetic as Stack._create_panels (panel by panel), so the result is
+    bit-identical to Stack.total_panel_area without building any panels
+    """
+    num_panels = np.asarray(num_panels)
+    mast_height = mast_h_boat_l_ratio * boat_length
+    mast_x = 0.55 * boat_length + .3
+    base_x0 = mast_x + base_mast_offset
+    base_x1 = base_x0 + base_length
+    front_offset = panel_spacing * (base_x1 - mast_x) / mast_height
+    back_offset = panel_spacing * base_mast_offset / mast_height
+
+    total = np.zeros(np.broadcast(num_panels, base_x0, front_offset, panel_width).shape)
+    for i in range(int(num_panels.max(initial=0))):
+        length = (base_x1 - i * front_offset) - (base_x0 - i * back_offset)
+        total += np.where(i < num_panels, length * panel_width, 0)
+    return total
+
+
+def configs_panel_area(columns):
+    """panel_area of many configs, columns maps the config fields to arrays (or values) over the configs"""
+    return panel_area(columns['num_panels'], columns['panel_spacing'], columns['panel_width'], columns['boat_length'],
+                      columns['base_mast_offset'], columns['base_length'], columns['mast_h_boat_l_ratio'])
+
+
+def cost(total_panel_area, panel_width, cost_panel, cost_frame):
+    """Stack.cost from the panel area, vectorized over the cost parameters"""
+    sum_panel_lengths = total_panel_area / panel_width
+    perimeter = 2 * (sum_panel_lengths + panel_width)
+    return np.trunc(np.asarray(cost_panel) * total_panel_area + np.asarray(cost_frame) * perimeter)
+
+
+def configs_shadow_area(columns, dx, dy, dz):
+    """shadow_area for many configs at once, shape (configs, positions)
+
+    columns maps the geometry fields to arrays over the configs (like
+    sweep.config_columns), the panels are built with the same arithmetic as
+    Stack._create_panels, so every row equals shadow_area of that config's Stack
+    """
+    c = {name: np.asarray(columns[name], dtype=float)[:, None] for name in
+         ('panel_spacing', 'panel_width', 'boat_length', 'base_mast_offset', 'base_length', 'base_height',
+          'mast_h_boat_l_ratio')}
+    num_panels = np.asarray(columns['num_panels'])[:, None]
+    mast_height = c['mast_h_boat_l_ratio'] * c['boat_length']
+    mast_x = 0.55 * c['boat_length'] + .3
+    base_x0 = mast_x + c['base_mast_offset']
+    base_x1 = base_x0 + c['base_length']
+    front_offset = c['panel_spacing'] * (base_x1 - mast_x) / mast_height
+    back_offset = c['panel_spacing'] * c['base_mast_offset'] / mast_height
+
+    def panel(i):
+        return base_x0 - i * back_offset, base_x1 - i * front_offset, i * c['panel_spacing'] + c['base_height']
+
+    dx, dy, dz = (np.asarray(v, dtype=float)[None, :] for v in np.broadcast_arrays(dx, dy, dz))
+    up = dz > 0
+    dz = np.where(up, dz, 1)
+    total = np.zeros(np.broadcast(num_panels, dz).shape)
+    for i in range(int(num_panels.max(initial=0)) - 1):
+        (lx0, lx1, lz), (ux0, ux1, uz) = panel(i), panel(i + 1)
+        t = (lz - uz) / dz
+        sx0 = ux0 + t * dx
+        sy0 = 0 + t * dy
+        sx1 = sx0 + (ux1 - ux0)
+        sy1 = sy0 + c['panel_width']
+
+        x0 = np.maximum(sx0, lx0)
+        y0 = np.maximum(sy0, 0)
+        x1 = np.minimum(sx1, lx1)
+        y1 = np.minimum(sy1, c['panel_width'])
+
+        overlap = (x0 < x1) & (y0 < y1) & up & (i + 1 < num_panels)
+        total += np.where(overlap, (x1 - x0) * (y1 - y0), 0)
+
+    return total
+
+
+def configs_power(columns, grid):
+    """power of many level configs at every position of the grid, shape (configs, positions)"""
+    fundamental, inverse, _ = grid.folded()
+    area = configs_panel_area(columns)
+    shadow = configs_shadow_area(columns, fundamental.dx, fundamental.dy, fundamental.dz)[:, inverse]
+    exposed = (area[:, None] - shadow) * FT2_TO_M2
+    eff = np.asarray(columns['eff'], dtype=float)[:, None]
+    return np.trunc(exposed * eff * grid.irradiance)
+
+
+def configs_average_power(columns, grid):
+    """average_power of many level configs in one vectorized pass (columns as in configs_shadow_area, plus eff)"""
+    return grid.mean(configs_power(columns, grid))
@@ -0,0 +1,279 @@
+"""Check the fast engine paths against the scalar Stack reference.
+
+Random and edge case StackConfigs (single panel, zero spacing, tiny panels) and
+sun positions (below the horizon, grazing, straight up) are evaluated by the
+reference (Stack.update_sun_direction_vector + Stack.power / cost, one position
+at a time) and by every fast path. Each path reports its largest error against
+its stated tolerance and its speedup over the reference.
+
+    python equivalence.py --configs 20 --positions 400 --seed 1
+
+exits with status 1 if any path is out of tolerance.
+"""
+import argparse
+import sys
+import time
+from dataclasses import fields
+
+import numpy as np
+
+import analytic
+import attitude
+import climatology
+import engine
+import occlusion
+import plot_analysis
+import polygons
+import sweep
+from stack import Stack, StackConfig
+
+# field -> (low, high) for random configs
+CONFIG_BOUNDS = {
+    'num_panels': (1, 10),
+    'panel_spacing': (0, 5),
+    'panel_width': (.5, 4),
+    'boat_length': (20, 60),
+    'base_mast_offset': (0, 8),
+    'base_length': (1, 10),
+    'base_height': (0, 3),
+    'eff': (.1, .25),
+    'cost_panel': (1, 20),
+    'cost_frame': (1, 20),
+    'mast_h_boat_l_ratio': (1, 1.6),
+}
+EDGE_CONFIGS = [
+    StackConfig(),
+    StackConfig(num_panels=1),
+    StackConfig(panel_spacing=0),
+    StackConfig(num_panels=10, panel_spacing=.1, panel_width=.1),
+    StackConfig(base_mast_offset=0, base_height=0),
+    StackConfig(num_panels=10, panel_spacing=5, boat_length=20),  # top panels past the mast top, inside out
+]
+EDGE_ELEVATIONS = [-10, -1e-9, 0, 1e-9, .01, 1, 45, 89.99, 90]
+EDGE_AZIMUTHS = [0, 1e-9, 90, 179.99, 180, 270, 359.99]
+
+# sun region of the averaged paths, analytic averages are continuous and compared
+# to a fine grid of truncated powers
+REGION = dict(azimuth_range=(90, 270), elevation_range=(15, 90))
+ANALYTIC_STEP = 1  # degrees between midpoints of the reference grid
+CELL_SIZE = occlusion.OFFLINE_CELL_SIZE  # raster occlusion resolution
+# (heading, boat azimuth) of the noon sun at 45 N in summer: due south is astern
+# with the bow north, to starboard with the bow east
+NOON_AZIMUTHS = [(0, 270), (90, 180), (180, 90), (270, 0)]
+ATTITUDE = dict(heel=12, pitch=-4, heading=30)  # boat attitude of the tilted engine check
+
+
+def random_configs(n, rng):
+    """n random configs within CONFIG_BOUNDS after the edge cases"""
+    configs = list(EDGE_CONFIGS)
+    for _ in range(n):
+        values = {name: rng.uniform(lo, hi) for name, (lo, hi) in CONFIG_BOUNDS.items()}
+        values['num_panels'] = int(rng.integers(*CONFIG_BOUNDS['num_panels'], endpoint=True))
+        configs.append(StackConfig(**values))
+    return configs
+
+
+def sun_positions(n, rng):
+    """(elevations, azimuths): every edge combination plus n random positions"""
+    el, az = np.meshgrid(EDGE_ELEVATIONS, EDGE_AZIMUTHS, indexing='ij')
+    elevations = np.concatenate([el.ravel(), rng.uniform(-10, 90, n)])
+    azimuths = np.concatenate([az.ravel(), rng.uniform(0, 360, n)])
+    return elevations, azimuths
+
+
+def reference_powers(stack, elevations, azimuths):
+    """Stack.power one position at a time, also returns the shadow areas"""
+    powers, shadows = [], []
+    for elevation, azimuth in zip(elevations.tolist(), azimuths.tolist()):
+        stack.update_sun_direction_vector(elevation, azimuth)
+        powers.append(stack.power)
+        shadows.append(stack.total_shadow_area)
+    return np.array(powers, dtype=float), np.array(shadows)
+
+
+class Check:
+    """running max error and timings of one fast path"""
+
+    def __init__(self, name, tolerance, relative=False):
+        self.name = name
+        self.tolerance = tolerance
+        self.relative = relative
+        self.max_error = 0.0
+        self.cases = 0
+        self.reference_time = 0.0
+        self.fast_time = 0.0
+
+    def compare(self, reference, fast, reference_time, fast_time):
+        reference, fast = np.asarray(reference, dtype=float), np.asarray(fast, dtype=float)
+        error = np.abs(fast - reference)
+        if self.relative:
+            error = error / np.maximum(np.abs(reference), 1)
+        self.max_error = max(self.max_error, float(error.max(initial=0)))
+        self.cases += reference.size
+        self.reference_time += reference_time
+        self.fast_time += fast_time
+
+    @property
+    def passed(self):
+        return self.max_error <= self.tolerance
+
+    @property
+    def speedup(self):
+        return self.reference_time / self.fast_time if self.fast_time else float('inf')
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(n_configs=20, n_positions=400, seed=0, degree_step=10):
+    """compare every fast path to the reference, returns the list of Checks"""
+    rng = np.random.default_rng(seed)
+    configs = random_configs(n_configs, rng)
+    elevations, azimuths = sun_positions(n_positions, rng)
+
+    checks = {name: Check(name, tolerance, relative) for name, tolerance, relative in [
+        ('engine.power', 0, False),
+        ('engine.power tilted', 1, False),  # the incidence scaling can flip the truncation
+        ('engine.shadow_area', 1e-9, False),
+        ('engine.panel_area', 0, False),
+        ('engine.cost', 0, False),
+        ('calc_power mirror memo', 0, False),
+        ('sweep.evaluate', 1e-12, True),
+        ('engine.configs_average_power', 1e-12, True),
+        ('polygons.PolygonStack', 1, False),  # beam * incidence can flip the truncation
+        ('attitude.power level', 1, False),
+        ('occlusion raster', 1, False),  # in units of the cell size error bound
+        ('analytic.average_power', .01, True),
+        ('climatology noon azimuth', 1, False),  # degrees
+    ]}
+
+    for config in configs:
+        stack = Stack(config)
+        (ref_power, ref_shadow), ref_time = timed(reference_powers, stack, elevations, azimuths)
+
+        grid, _ = timed(engine.SunGrid, elevations, azimuths)
+        power, t = timed(engine.power, stack, grid)
+        checks['engine.power'].compare(ref_power, power, ref_time, t)
+
+        (tilted_power, _), tilted_time = timed(reference_powers, Stack(config, **ATTITUDE), elevations, azimuths)
+        power, t = timed(engine.power, Stack(config, **ATTITUDE), grid)
+        checks['engine.power tilted'].compare(tilted_power, power, tilted_time, t)
+
+        dx, dy, dz = engine.sun_direction(elevations, azimuths)
+        shadow, t = timed(engine.shadow_area, stack, dx, dy, dz)
+        checks['engine.shadow_area'].compare(ref_shadow, shadow, ref_time, t)
+
+        values = [getattr(config, name) for name in ('num_panels', 'panel_spacing', 'panel_width', 'boat_length',
+                                                     'base_mast_offset', 'base_length', 'mast_h_boat_l_ratio')]
+        (area, ref_time_area) = timed(lambda: Stack(config).total_panel_area)
+        fast_area, t = timed(engine.panel_area, *values)
+        checks['engine.panel_area'].compare(area, fast_area, ref_time_area, t)
+        cost, t = timed(engine.cost, fast_area, config.panel_width, config.cost_panel, config.cost_frame)
+        checks['engine.cost'].compare(stack.cost, cost, ref_time_area, t)
+
+        polygon_stack = polygons.PolygonStack.from_stack(stack)
+        power, t = timed(polygon_stack.power, elevations, azimuths)
+        checks['polygons.PolygonStack'].compare(ref_power, power, ref_time, t)
+
+        power, t = timed(attitude.power, stack, elevations, azimuths)
+        checks['attitude.power level'].compare(ref_power, power, ref_time, t)
+
+        _check_grid_average(checks, config, degree_step)
+        _check_occlusion(checks, stack, elevations, azimuths, ref_power, ref_time)
+        _check_analytic(checks, stack)
+
+    _check_climatology(checks)
+    return list(checks.values())
+
+
+def _check_grid_average(checks, config, degree_step):
+    """calc_power and sweep.evaluate against the plain scalar grid average"""
+    azimuth_range, elevation_range = REGION['azimuth_range'], REGION['elevation_range']
+    az, el = np.meshgrid(np.arange(azimuth_range[0], azimuth_range[1] + 1, degree_step),
+                         np.arange(elevation_range[0], elevation_range[1] + 1, degree_step), indexing='ij')
+    (powers, _), ref_time = timed(reference_powers, Stack(config), el.ravel(), az.ravel())
+    reference = powers.mean()
+
+    average, t = timed(plot_analysis.calc_power, Stack(config), azimuth_range, elevation_range, degree_step)
+    checks['calc_power mirror memo'].compare(reference, average, ref_time, t)
+
+    def evaluate():
+        grid = engine.SunGrid.from_ranges(azimuth_range, elevation_range, degree_step)
+        return next(sweep.evaluate(config, {}, grid))[2]
+    average, t = timed(evaluate)
+    checks['sweep.evaluate'].compare(reference, average, ref_time, t)
+
+    def configs_average():
+        grid = engine.SunGrid.from_ranges(azimuth_range, elevation_range, degree_step)
+        columns = {f.name: np.array([getattr(config, f.name)]) for f in fields(StackConfig)}
+        return engine.configs_average_power(columns, grid)[0]
+    average, t = timed(configs_average)
+    checks['engine.configs_average_power'].compare(reference, average, ref_time, t)
+
+
+def _check_occlusion(checks, stack, elevations, azimuths, ref_power, ref_time):
+    """raster occlusion restricted to the Stack model (adjacent panels, no mast)"""
+    raster = occlusion.RasterOcclusion(stack, CELL_SIZE, include_mast=False, adjacent_only=True)
+    power, t = timed(raster.power, elevations, azimuths)
+    # a cell can only be wrong where a shadow edge crosses it, so the area error is at
+    # most cell size x panel perimeters. errors are in units of that bound, with 1 W on
+    # top because truncation can round the two either way
+    perimeter = sum(2 * (panel.length + panel.width) for panel in stack.panels)
+    bound = perimeter * CELL_SIZE * engine.FT2_TO_M2 * stack.eff * engine.solar_irradiance(elevations)
+    error = np.maximum(np.abs(power - ref_power) - 1, 0) / np.maximum(bound, 1e-9)
+    check = checks['occlusion raster']
+    check.max_error = max(check.max_error, float(error.max(initial=0)))
+    check.cases += len(power)
+    check.reference_time += ref_time
+    check.fast_time += t
+
+
+def _check_analytic(checks, stack):
+    """exact region average against a fine midpoint grid of the reference"""
+    (az_lo, az_hi), (el_lo, el_hi) = REGION['azimuth_range'], REGION['elevation_range']
+    az, el = np.meshgrid(np.arange(az_lo + ANALYTIC_STEP / 2, az_hi, ANALYTIC_STEP),
+                         np.arange(el_lo + ANALYTIC_STEP / 2, el_hi, ANALYTIC_STEP), indexing='ij')
+    (powers, _), ref_time = timed(reference_powers, stack, el.ravel(), az.ravel())
+    # the reference truncates every power to whole watts, on average half a watt
+    reference = powers.mean() + .5
+    average, t = timed(analytic.average_power, stack, **REGION)
+    checks['analytic.average_power'].compare(reference, average, ref_time, t)
+
+
+def _check_climatology(checks):
+    """the heaviest position of the highest weighted elevation (noon) against NOON_AZIMUTHS"""
+    for heading, azimuth in NOON_AZIMUTHS:
+        grid, t = timed(climatology.weighted_grid, (0, 359), (0, 89), 1, 45, 'summer', heading)
+        top = grid.elevations == grid.elevations[grid.weights > 0].max()
+        noon = grid.azimuths[top][np.argmax(grid.weights[top])]
+        error = (noon - azimuth + 180) % 360 - 180
+        checks['climatology noon azimuth'].compare(0, error, 0, t)
+
+
+def report(checks, out=sys.stdout):
+    print(f"{'path':<30}{'cases':>8}{'max error':>13}{'tolerance':>11}{'speedup':>10}  result", file=out)
+    for check in checks:
+        unit = ' rel' if check.relative else ''
+        print(f"{check.name:<30}{check.cases:>8}{check.max_error:>13.3g}{check.tolerance:>11g}{unit:<4}"
+              f"{check.speedup:>6.1f}x  {'ok' if check.passed else 'FAIL'}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="compare the fast engine paths to the scalar Stack")
+    parser.add_argument('--configs', type=int, default=20, help="random configs on top of the edge cases")
+    parser.add_argument('--positions', type=int, default=400, help="random sun positions on top of the edge cases")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--degree-step', type=int, default=10, help="grid step of the averaged paths")
+    args = parser.parse_args(argv)
+
+    checks = run(args.configs, args.positions, args.seed, args.degree_step)
+    report(checks)
+    if not all(check.passed for check in checks):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
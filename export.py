@@ -0,0 +1,147 @@
+"""Binary export/import of stack geometry, power grids and sweep tables.
+
+Every file holds named numeric arrays plus a metadata dict (kind, config, grid
+axes, irradiance model, engine.MODEL_VERSION), so results can be reused without
+re-running the engine or parsing JSON:
+
+    .npz    numpy archive, written uncompressed so load() memory-maps the arrays
+    .arrow  Arrow IPC file (needs pyarrow), load() maps it and returns zero-copy views
+
+    export.save('stack.npz', *export.geometry(stack))
+    export.save('heatmap.npz', *export.power_grid(stack, (90, 270), (0, 90), 1))
+    export.save('sweep.arrow', *export.sweep_table(base, ranges, grid))
+    arrays, meta = export.load('heatmap.npz')   # arrays['power'] is a read-only memmap
+
+Arrow tables are flat, so 2-D arrays are stored flattened with their shape in
+the metadata and reshaped (still without a copy) on load.
+"""
+import json
+import struct
+import zipfile
+from dataclasses import asdict, astuple
+
+import numpy as np
+
+import engine
+import sweep
+
+META_KEY = '__meta__'  # npz member / arrow schema metadata key holding the json metadata
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')  # fixed part of a zip local file header
+
+
+def _metadata(kind, stack=None, **extra):
+    meta = {'kind': kind, 'model_version': engine.MODEL_VERSION}
+    if stack is not None:
+        meta['config'] = asdict(stack.config)
+        meta['irradiance_model'] = type(stack.irradiance_model).__name__
+    meta.update(extra)
+    return meta
+
+
+def geometry(stack):
+    """(arrays, metadata) of a stack's panels: x0, x1, y0, y1, z per panel (ft)"""
+    panels = np.array([(p.x0, p.x1, p.y0, p.y1, p.z) for p in stack.panels], dtype=float).reshape(-1, 5)
+    arrays = {name: panels[:, i].copy() for i, name in enumerate(('x0', 'x1', 'y0', 'y1', 'z'))}
+    return arrays, _metadata('geometry', stack, mast_height=stack.mast_height,
+                             total_panel_area=stack.total_panel_area)
+
+
+def power_grid(stack, azimuth_range, elevation_range, degree_step):
+    """(arrays, metadata) of the power at every sun position, power[azimuth, elevation] like calc_power"""
+    grid = engine.SunGrid.from_ranges(azimuth_range, elevation_range, degree_step, stack.irradiance_model)
+    azimuths = np.unique(grid.azimuths)
+    elevations = np.unique(grid.elevations)
+    power = engine.power(stack, grid).reshape(len(azimuths), len(elevations))
+    return ({'azimuth': azimuths, 'elevation': elevations, 'power': power},
+            _metadata('power_grid', stack, azimuth_range=list(azimuth_range),
+                      elevation_range=list(elevation_range), degree_step=degree_step))
+
+
+def sweep_table(base, ranges, grid):
+    """(arrays, metadata) with one column per config field plus power and cost, in sweep order"""
+    rows = [(index,) + astuple(cfg) + (power, cost) for index, cfg, power, cost in sweep.evaluate(base, ranges, grid)]
+    names = ['index'] + sweep.CONFIG_FIELDS + ['power', 'cost']
+    columns = np.array(rows, dtype=float).reshape(-1, len(names))
+    arrays = {name: columns[:, i].copy() for i, name in enumerate(names)}
+    for name in ('index', 'num_panels', 'cost'):
+        arrays[name] = arrays[name].astype(np.int64)
+    return arrays, _metadata('sweep', base=asdict(base), ranges=ranges, grid_size=len(grid),
+                             weighted=grid.weights is not None)
+
+
+def save(path, arrays, metadata):
+    """write arrays and metadata, .arrow for Arrow IPC, anything else as an uncompressed npz"""
+    if str(path).endswith('.arrow'):
+        _save_arrow(path, arrays, metadata)
+        return
+    members = {name: np.ascontiguousarray(value) for name, value in arrays.items()}
+    members[META_KEY] = np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8)
+    with open(path, 'wb') as f:
+        np.savez(f, **members)
+
+
+def load(path):
+    """(arrays, metadata) from a file written by save, arrays are read-only memory-mapped views"""
+    if str(path).endswith('.arrow'):
+        return _load_arrow(path)
+
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4]  # strip .npy
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(archive.open(info.filename))  # compressed, can't be mapped
+                continue
+            # the member data starts after its local header, then comes the .npy header
+            f.seek(info.header_offset)
+            header = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+            f.seek(info.header_offset + ZIP_LOCAL_HEADER.size + header[-2] + header[-1])
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                     order='F' if fortran else 'C')
+
+    metadata = json.loads(bytes(arrays.pop(META_KEY)).decode())
+    return arrays, metadata
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise SystemExit("arrow files need pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _save_arrow(path, arrays, metadata):
+    pa = _pyarrow()
+    columns = {name: np.ravel(value) for name, value in arrays.items()}
+    # columns of one length share a record batch, others (e.g. grid axes and the grid) get their own
+    lengths = list(dict.fromkeys(len(column) for column in columns.values()))
+    batches = {name: lengths.index(len(column)) for name, column in columns.items()}
+    metadata = dict(metadata, shapes={name: list(np.shape(value)) for name, value in arrays.items()},
+                    batches=batches)
+
+    schema = pa.schema([pa.field(name, pa.from_numpy_dtype(column.dtype)) for name, column in columns.items()],
+                       metadata={META_KEY: json.dumps(metadata)})
+    with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for b, length in enumerate(lengths):
+            writer.write_batch(pa.record_batch(
+                [pa.array(column) if batches[name] == b else pa.nulls(length, field.type)
+                 for (name, column), field in zip(columns.items(), schema)], schema=schema))
+
+
+def _load_arrow(path):
+    pa = _pyarrow()
+    reader = pa.ipc.open_file(pa.memory_map(str(path), 'r'))
+    metadata = json.loads(reader.schema.metadata[META_KEY.encode()])
+    shapes = metadata.pop('shapes')
+    batches = metadata.pop('batches')
+    arrays = {}
+    for name in reader.schema.names:
+        column = reader.get_batch(batches[name]).column(name)
+        arrays[name] = column.to_numpy(zero_copy_only=True).reshape(shapes[name])
+    return arrays, metadata
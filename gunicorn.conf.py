@@ -0,0 +1,20 @@
+"""gunicorn settings, run with `gunicorn -c gunicorn.conf.py app:server`
+
+With SOLAR_STACK_WARMUP=1 the app is preloaded so the warm-up (see warmup.py)
+runs once in the master and the forked workers share its caches.
+"""
+import os
+
+bind = os.environ.get('SOLAR_STACK_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('SOLAR_STACK_THREADS', 1))
+
+if threads > 1:
+    # plotly serializes figures while another thread may be half way through the
+    # lazy pandas import, so threaded workers import everything up front
+    os.environ.setdefault('SOLAR_STACK_LAZY', '0')
+
+preload_app = os.environ.get('SOLAR_STACK_WARMUP', '0') != '0'
+if preload_app:
+    # load everything in the master so workers inherit it instead of importing it again
+    os.environ.setdefault('SOLAR_STACK_LAZY', '0')
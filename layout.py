@@ -72,6 +72,10 @@ LAYOUT = html.Div(className='container', children=[
                             html.Span(id='estimated-cost', className='power-estimate-value')
                         ])
                 ]),
+                html.Div(className='power-estimate-container', children=[
+                    html.Div("Sensitivity per Step", className='power-estimate-title'),
+                    html.Div(id='sensitivity-table', className='sensitivity-table')
+                ]),
             ]),
 
             # Plot column
@@ -268,6 +272,7 @@ LAYOUT = html.Div(className='container', children=[
         ]),
 
         html.Div(className='plot-column', children=[
+            html.Div(id='analysis-message', className='analysis-message'),
             dcc.Graph(id='analysis-plot', style={'height': '100%', 'width': '100%'})
         ])
     ])
@@ -419,6 +424,30 @@ INDEX_STRING = '''
                 margin-left: 4px;
             }
 
+            .analysis-message {
+                font-size: 13px;
+                color: #b7791f;
+            }
+
+            .analysis-message:empty {
+                display: none;
+            }
+
+            .sensitivity-table table {
+                width: 100%;
+                font-size: 12px;
+                border-collapse: collapse;
+            }
+
+            .sensitivity-table th, .sensitivity-table td {
+                padding: 2px 4px;
+                text-align: right;
+            }
+
+            .sensitivity-table th:first-child, .sensitivity-table td:first-child {
+                text-align: left;
+            }
+
             .nav-link:hover {
                 background-color: #f0f0f0;
             }
@@ -0,0 +1,305 @@
+"""Replay user interaction traces against a running app server.
+
+Virtual users run concurrently, each with its own page state, and pick traces
+from a weighted mix:
+
+    slider-drag     drag elevation-slider or azimuth-slider through a run of values
+    heatmap-toggle  press plot-toggle-button a few times (3D view <-> heatmap)
+    analysis-visit  open the analysis page (page + analysis callbacks) and go back home
+
+Every trace step is the POST to /_dash-update-component the browser would send.
+The callback definitions and initial input values are read from the server
+(/_dash-dependencies and /_dash-layout), so payloads follow the app as it
+changes. Requests accept gzip like a browser. Latency percentiles and
+throughput are reported per callback.
+
+    python loadtest.py --url http://127.0.0.1:8000 --users 16 --duration 30
+    python loadtest.py --serve 1x1 2x1 2x4 4x2 --users 16 --duration 30
+
+--serve starts `gunicorn -c gunicorn.conf.py app:server` once per WORKERSxTHREADS
+setting and load tests each in turn. Only the standard library is needed.
+"""
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+UPDATE_PATH = '/_dash-update-component'
+TRACE_MIX = {'slider-drag': 6, 'heatmap-toggle': 3, 'analysis-visit': 1}
+CALLBACK_NAMES = {'sun-shadow-plot': 'main', 'analysis-plot': 'analysis', 'home-page': 'page'}
+BOAT_LENGTHS = (30, 36, 40, 44)  # boat sizes the virtual users pick from
+DRAG_STEPS = 10  # slider values sent per drag
+PERCENTILES = (50, 95, 99)
+
+
+def parse_outputs(output):
+    """Dash output string -> (id, property) list, '..a.b...c.d..' for multi output callbacks"""
+    multi = output.startswith('..')
+    parts = output[2:-2].split('...') if multi else [output]
+    return [tuple(part.rsplit('.', 1)) for part in parts], multi
+
+
+def layout_values(node, values=None):
+    """(id, property) -> initial value for every prop of every component with an id"""
+    values = {} if values is None else values
+    if isinstance(node, list):
+        for child in node:
+            layout_values(child, values)
+    elif isinstance(node, dict) and 'props' in node:
+        props = node['props']
+        if isinstance(props.get('id'), str):
+            for name, value in props.items():
+                if name != 'children':
+                    values[(props['id'], name)] = value
+        layout_values(props.get('children'), values)
+    return values
+
+
+class App:
+    """callbacks and initial values of the app at base_url"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.callbacks = {}
+        for callback in self._get_json('/_dash-dependencies'):
+            outputs, multi = parse_outputs(callback['output'])
+            name = CALLBACK_NAMES.get(outputs[0][0], outputs[0][0])
+            self.callbacks[name] = dict(callback, outputs_list=outputs, multi=multi)
+        self.initial = layout_values(self._get_json('/_dash-layout'))
+
+    def _get_json(self, path):
+        with urllib.request.urlopen(self.base_url + path, timeout=30) as response:
+            return json.load(response)
+
+    def payload(self, name, values, changed=()):
+        """body of the update request for callback name with the current input values"""
+        callback = self.callbacks[name]
+        outputs = [{'id': i, 'property': p} for i, p in callback['outputs_list']]
+
+        def props(items):
+            return [{'id': item['id'], 'property': item['property'],
+                     'value': values.get((item['id'], item['property']))} for item in items]
+        return {
+            'output': callback['output'],
+            'outputs': outputs if callback['multi'] else outputs[0],
+            'inputs': props(callback['inputs']),
+            'state': props(callback['state']),
+            'changedPropIds': [f"{i}.{p}" for i, p in changed],
+        }
+
+
+class User:
+    """one browser tab: its own input values and keep-alive connection"""
+
+    def __init__(self, app, rng, record, think=0):
+        self.app = app
+        self.rng = rng
+        self.record = record
+        self.think = think
+        self.values = dict(app.initial)
+        self.values[('url', 'pathname')] = '/'
+        boat_length = rng.choice(BOAT_LENGTHS)
+        self.values[('boat-length-input', 'value')] = boat_length
+        self.values[('boat-length-input-2', 'value')] = boat_length
+
+        url = urllib.parse.urlsplit(app.base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.connection = None
+
+    def post(self, name, changed):
+        body = json.dumps(self.app.payload(name, self.values, changed))
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            self.connection.request('POST', UPDATE_PATH, body, {'Content-Type': 'application/json',
+                                                                'Accept-Encoding': 'gzip'})
+            response = self.connection.getresponse()
+            data = response.read()
+            if response.getheader('Content-Encoding') == 'gzip':
+                gzip.decompress(data)
+            ok = response.status in (200, 204)
+        except (OSError, http.client.HTTPException):
+            if self.connection:
+                self.connection.close()
+            self.connection = None
+            ok = False
+        self.record(name, time.perf_counter() - start, ok)
+        if self.think:
+            time.sleep(self.think)
+
+    def set(self, key, value, callback):
+        self.values[key] = value
+        self.post(callback, [key])
+
+    def slider_drag(self):
+        slider = self.rng.choice(['elevation-slider', 'azimuth-slider'])
+        low = self.values.get((slider, 'min'), 0)
+        high = self.values.get((slider, 'max'), 90)
+        value = self.values[(slider, 'value')]
+        step = self.rng.choice([-1, 1]) * (high - low) / 60
+        for _ in range(DRAG_STEPS):
+            if not low <= value + step <= high:
+                step = -step
+            value = round(value + step, 2)
+            self.set((slider, 'value'), value, 'main')
+
+    def heatmap_toggle(self):
+        for _ in range(self.rng.randint(1, 3)):
+            key = ('plot-toggle-button', 'n_clicks')
+            self.set(key, (self.values.get(key) or 0) + 1, 'main')
+
+    def analysis_visit(self):
+        self.set(('url', 'pathname'), '/analysis', 'page')
+        self.post('analysis', [])  # initial call of the newly shown page
+        self.set(('url', 'pathname'), '/', 'page')
+
+    def run(self, deadline, mix):
+        traces = {'slider-drag': self.slider_drag, 'heatmap-toggle': self.heatmap_toggle,
+                  'analysis-visit': self.analysis_visit}
+        names, weights = zip(*mix.items())
+        while time.perf_counter() < deadline:
+            traces[self.rng.choices(names, weights)[0]]()
+
+
+def run_load(base_url, users=8, duration=30, mix=None, seed=0, think=0):
+    """run users virtual users for duration seconds
+
+    returns:
+        (samples, elapsed): samples is a list of (callback, latency seconds, ok)
+    """
+    app = App(base_url)
+    samples = []
+    lock = threading.Lock()
+
+    def record(name, latency, ok):
+        with lock:
+            samples.append((name, latency, ok))
+
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = [threading.Thread(target=User(app, random.Random(seed + i), record, think).run,
+                                args=(deadline, mix or TRACE_MIX), daemon=True)
+               for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def percentile(values, q):
+    """q-th percentile (0-100), linear between the closest ranks like numpy's default, nan when empty"""
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    rank = (len(values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(samples, elapsed):
+    """per callback (and 'all') request count, errors, latency percentiles (ms) and throughput"""
+    rows = {}
+    for name in sorted({s[0] for s in samples}) + ['all']:
+        selected = [s for s in samples if name in ('all', s[0])]
+        latencies = [s[1] * 1000 for s in selected if s[2]]
+        row = {'requests': len(selected), 'errors': sum(not s[2] for s in selected),
+               'throughput': len(selected) / elapsed}
+        for q in PERCENTILES:
+            row[f'p{q}'] = percentile(latencies, q)
+        rows[name] = row
+    return rows
+
+
+def report(rows, title='', out=sys.stdout):
+    if title:
+        print(title, file=out)
+    header = ''.join(f"{f'p{q} ms':>10}" for q in PERCENTILES)
+    print(f"{'callback':<12}{'requests':>10}{'errors':>8}{header}{'req/s':>9}", file=out)
+    for name, row in rows.items():
+        percentiles = ''.join(f"{row[f'p{q}']:>10.1f}" for q in PERCENTILES)
+        print(f"{name:<12}{row['requests']:>10}{row['errors']:>8}{percentiles}{row['throughput']:>9.1f}", file=out)
+
+
+def serve(workers, threads, port):
+    """start gunicorn with this worker/thread setting and wait until it answers"""
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), SOLAR_STACK_THREADS=str(threads),
+               SOLAR_STACK_BIND=f'127.0.0.1:{port}')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:server'],
+                               env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(600):
+        if process.poll() is not None:
+            raise SystemExit(f"gunicorn exited with status {process.returncode}")
+        try:
+            urllib.request.urlopen(url + '/_dash-dependencies', timeout=1).close()
+            return process, url
+        except OSError:
+            time.sleep(.1)
+    process.terminate()
+    raise SystemExit("gunicorn did not start within 60s")
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        if name not in TRACE_MIX:
+            raise SystemExit(f"unknown trace {name!r}, choose from {', '.join(TRACE_MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="load test the app's Dash callbacks")
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="server to test (ignored with --serve)")
+    parser.add_argument('--serve', nargs='+', metavar='WORKERSxTHREADS',
+                        help="start gunicorn with each setting in turn, e.g. 2x4")
+    parser.add_argument('--port', type=int, default=8050, help="port for --serve")
+    parser.add_argument('--users', type=int, default=8, help="concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of measured load")
+    parser.add_argument('--warmup', type=float, default=0, help="seconds of unmeasured load first")
+    parser.add_argument('--think', type=float, default=0, help="seconds each user waits between requests")
+    parser.add_argument('--mix', type=parse_mix, default=TRACE_MIX,
+                        help="trace weights, e.g. slider-drag=6,heatmap-toggle=3,analysis-visit=1")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the results to this json file")
+    args = parser.parse_args(argv)
+
+    targets = [(None, args.url)] if not args.serve else [(setting, None) for setting in args.serve]
+    results = {}
+    for setting, url in targets:
+        process = None
+        if setting:
+            workers, threads = (int(n) for n in setting.lower().split('x'))
+            process, url = serve(workers, threads, args.port)
+        try:
+            if args.warmup:
+                run_load(url, args.users, args.warmup, args.mix, args.seed, args.think)
+            samples, elapsed = run_load(url, args.users, args.duration, args.mix, args.seed, args.think)
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+        rows = summarize(samples, elapsed)
+        label = f"gunicorn {setting} (workers x threads)" if setting else url
+        report(rows, f"{label}, {args.users} users, {elapsed:.1f}s")
+        results[setting or url] = rows
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Rasterized occlusion: panel and mast shadows on the stack.
+
+Every panel is split into a grid of cells. For each cell center a ray is cast
+toward the sun and tested against every higher panel and against the mast
+cylinder drawn by plot_interactive.create_cylinder, all as numpy arrays over
+(sun positions x cells). The exposed area is the area of the unblocked cells,
+so it is exact up to the cell size. cell_size is the speed/accuracy knob:
+
+    RasterOcclusion(stack, INTERACTIVE_CELL_SIZE)  coarse, fast enough per slider move
+    RasterOcclusion(stack, OFFLINE_CELL_SIZE)      fine, for offline sweeps
+"""
+import math
+
+import numpy as np
+
+import engine
+import plot_interactive
+
+INTERACTIVE_CELL_SIZE = 0.25  # ft
+OFFLINE_CELL_SIZE = 0.02  # ft
+
+
+class RasterOcclusion:
+    """exposed area of a stack's panels including the mast shadow, on a raster of panel cells
+
+    args:
+        stack: Stack to evaluate (level boat)
+        cell_size: target cell edge length in ft, cells are shrunk to tile each panel exactly
+        include_mast: cast the mast shadow as well as the panel shadows
+        adjacent_only: only let each panel shade the one directly below (the Stack model),
+            otherwise every higher panel can shade it
+        max_elements: largest (positions x cells) array built at once
+    """
+
+    def __init__(self, stack, cell_size=INTERACTIVE_CELL_SIZE, include_mast=True,
+                 adjacent_only=False, max_elements=2 ** 22):
+        self.stack = stack
+        self.include_mast = include_mast
+        self.adjacent_only = adjacent_only
+        self.max_elements = max_elements
+
+        self.mast_x = stack.boat_length * plot_interactive.MAST_POSITION
+        self.mast_y = stack.panel_width / 2
+        self.mast_radius = plot_interactive.MAST_RADIUS
+
+        # cell centers and cell area of every panel
+        self.cells = []
+        for panel in stack.panels:
+            nx = max(1, math.ceil(panel.length / cell_size))
+            ny = max(1, math.ceil(panel.width / cell_size))
+            xs = panel.x0 + (np.arange(nx) + .5) * panel.length / nx
+            ys = panel.y0 + (np.arange(ny) + .5) * panel.width / ny
+            x, y = np.meshgrid(xs, ys, indexing='ij')
+            self.cells.append((x.ravel(), y.ravel(), panel.area() / (nx * ny)))
+
+    @property
+    def n_cells(self):
+        return sum(len(x) for x, _, _ in self.cells)
+
+    def _blocked(self, i, x, y, dx, dy, dz):
+        """mask (positions x cells) of panel i cells whose ray to the sun is blocked"""
+        lower = self.stack.panels[i]
+        blocked = np.zeros(np.broadcast(x, dx).shape, dtype=bool)
+
+        uppers = self.stack.panels[i + 1:i + 2] if self.adjacent_only else self.stack.panels[i + 1:]
+        for upper in uppers:
+            t = (upper.z - lower.z) / dz
+            hit_x = x + t * dx
+            hit_y = y + t * dy
+            blocked |= (hit_x >= upper.x0) & (hit_x <= upper.x1) & (hit_y >= upper.y0) & (hit_y <= upper.y1)
+
+        if self.include_mast:
+            # ray vs vertical cylinder in the horizontal plane: a t^2 + b t + c = 0
+            ox, oy = x - self.mast_x, y - self.mast_y
+            a = dx ** 2 + dy ** 2
+            b = 2 * (ox * dx + oy * dy)
+            c = ox ** 2 + oy ** 2 - self.mast_radius ** 2
+            disc = b ** 2 - 4 * a * c
+            with np.errstate(divide='ignore', invalid='ignore'):
+                root = np.sqrt(np.maximum(disc, 0))
+                t_in = (-b - root) / (2 * a)
+                t_out = (-b + root) / (2 * a)
+            # the ray climbs while crossing the mast, so it is blocked if it enters below the top
+            enter_z = lower.z + np.maximum(t_in, 0) * dz
+            blocked |= (a > 0) & (disc >= 0) & (t_out > 0) & (enter_z <= self.stack.mast_height)
+
+        return blocked
+
+    def exposed_area(self, elevations, azimuths):
+        """exposed panel area (ft^2) for arrays of sun positions, evaluated in batches"""
+        elevations, azimuths = np.broadcast_arrays(np.atleast_1d(np.asarray(elevations, dtype=float)),
+                                                   np.atleast_1d(np.asarray(azimuths, dtype=float)))
+        dx, dy, dz = engine.sun_direction(elevations.ravel(), azimuths.ravel())
+        up = dz > 0
+        exposed = np.full(dz.shape, float(self.stack.total_panel_area))
+
+        batch = max(1, self.max_elements // max(1, max(len(x) for x, _, _ in self.cells)))
+        for start in range(0, len(dz), batch):
+            part = slice(start, start + batch)
+            sun = [component[part][:, None] for component in (dx, dy, np.where(up, dz, 1))]
+            shadow = np.zeros(len(sun[0]))
+            for i, (x, y, cell_area) in enumerate(self.cells):
+                shadow += self._blocked(i, x, y, *sun).sum(axis=1) * cell_area
+            exposed[part] -= np.where(up[part], shadow, 0)
+
+        return exposed.reshape(elevations.shape)
+
+    def power(self, elevations, azimuths, model=None):
+        """truncated power (like Stack.power) for arrays of sun positions"""
+        elevations = np.asarray(elevations, dtype=float)
+        area = self.exposed_area(elevations, azimuths) * engine.FT2_TO_M2
+        irradiance = (model or self.stack.irradiance_model)(np.broadcast_to(elevations, area.shape))
+        return np.trunc(area * self.stack.eff * irradiance)
@@ -1,28 +1,51 @@
 import numpy as np
 import plotly.graph_objs as go
+from dataclasses import astuple, replace
+from functools import lru_cache
 from stack import Stack, StackConfig
-import pandas as pd
-import plotly.express as px
+import engine
+import sweep
 import plotly.graph_objects as go
 
+# pandas and plotly.express are imported inside the functions that use them,
+# they are slow to import and only needed once an analysis actually runs
+
+CACHE_SIZE = 256  # results kept per cached function (sweeps and heatmap grids)
+WEBGL_POINTS = 1000  # larger budget frontiers are drawn with WebGL
+
 
 def calc_power(stack, azimuth_range, elevation_range, degree_step, avg=True):
-        """calculate average power over range or creates dataset for power values over range"""
+        """calculate average power over range or creates dataset for power values over range
+
+        a stack symmetric about the boat centerline has the same power at azimuth
+        az and 180 - az, so only one of each mirrored pair is evaluated
+        """
         azimuths = range(azimuth_range[0], azimuth_range[1] + 1, degree_step)
         elevations = range(elevation_range[0], elevation_range[1] + 1, degree_step)
+        symmetric = engine.is_mirror_symmetric(stack)
 
-        results = []
+        powers = {}  # (elevation, azimuth in the fundamental domain) -> power
+        results = []  # only built for the dataset, the average is a running sum
+        total = 0
         for azimuth in azimuths:
                 for elevation in elevations:
-                    stack.update_sun_direction_vector(elevation, azimuth)
-                    results.append({'azimuth': azimuth, 'elevation': elevation, 'power': stack.power})
+                    key = (elevation, engine.mirror_azimuth(azimuth) if symmetric else azimuth)
+                    if key not in powers:
+                        stack.update_sun_direction_vector(*key)
+                        powers[key] = stack.power
+                    if avg:
+                        total += powers[key]
+                    else:
+                        results.append({'azimuth': azimuth, 'elevation': elevation, 'power': powers[key]})
 
         if avg: 
-            return sum(r['power'] for r in results) / len(results)
+            return total / (len(azimuths) * len(elevations))
         else:
+            import pandas as pd
             return pd.DataFrame(results)
 
 def max_power_budget(df, n_budget_samples=50):
+    import pandas as pd
      
     # Create array of budgets
     min_budget = df['cost'].min()
@@ -51,21 +74,50 @@ def max_power_budget(df, n_budget_samples=50):
                 })
     return pd.DataFrame(results)
 
-def pow_budget_fig(df):
+def pow_budget_fig(df, webgl=None):
+    """budget vs max power frontier, one marker trace and one step-line trace per panel count
+
+    webgl: draw with Scattergl, by default only for frontiers of more than WEBGL_POINTS points
+    """
+    import plotly.express as px
+    if webgl is None:
+        webgl = len(df) > WEBGL_POINTS
+    scatter = go.Scattergl if webgl else go.Scatter
+
+    palette = px.colors.qualitative.Set2
     unique_nums = sorted(df['num'].unique())
-    color_map = {num: color for num, color in zip(unique_nums, px.colors.qualitative.Set2)}
+    color_map = {num: palette[i % len(palette)] for i, num in enumerate(unique_nums)}
     fig = go.Figure()
 
+    # each point's horizontal segment runs to the next point, in the color of its panel count
+    budget = df['budget'].to_numpy()
+    max_p = df['max_P'].to_numpy()
+    segment_end = np.append(budget[1:], budget[-1:])
+    has_segment = np.arange(len(df)) < len(df) - 1
+    hovertemplate = ('Num: %{customdata[0]}<br>Spacing: %{customdata[1]:.2f}<br>Width: %{customdata[2]:.2f}'
+                     '<br>Cost: %{x:.2f}<br>Power: %{y:.2f}<extra></extra>')
+
     for num in unique_nums:
-        subset = df[df['num'] == num]
+        in_num = (df['num'] == num).to_numpy()
+        subset = df[in_num]
+
+        # step segments separated by gaps: x0, x1, None per segment
+        lines = in_num & has_segment
+        xs = np.full((lines.sum(), 3), None, dtype=object)
+        ys = np.full((lines.sum(), 3), None, dtype=object)
+        xs[:, 0], xs[:, 1] = budget[lines], segment_end[lines]
+        ys[:, 0], ys[:, 1] = max_p[lines], max_p[lines]
+        fig.add_trace(scatter(
+            x=xs.ravel(),
+            y=ys.ravel(),
+            mode='lines',
+            line=dict(color=color_map[num]),
+            hoverinfo='skip',
+            showlegend=False
+        ))
 
-        hover_texts = [
-            f"Num: {row['num']}<br>Spacing: {row['spacing']:.2f}<br>Width: {row['width']:.2f}<br>Cost: {row['budget']:.2f}<br>Power: {row['max_P']:.2f}"
-            for _, row in subset.iterrows()
-        ]
-        
         # Add markers
-        fig.add_trace(go.Scatter(
+        fig.add_trace(scatter(
             x=subset['budget'],
             y=subset['max_P'],
             mode='markers',
@@ -74,19 +126,8 @@ def pow_budget_fig(df):
             legendgroup='num',
             legendgrouptitle=dict(text="Number of Panels") if num == unique_nums[0] else None,
             showlegend=True,
-            text=hover_texts,
-            hoverinfo='text'
-        ))
-        
-    # Add horizontal lines to next points
-    for i in range(len(df)-1):
-        curr, next = df.iloc[i], df.iloc[i+1]
-        fig.add_trace(go.Scatter(
-            x=[curr['budget'], next['budget']],
-            y=[curr['max_P'], curr['max_P']],
-            mode='lines',
-            line=dict(color=color_map[curr['num']]),
-            showlegend=False
+            customdata=subset[['num', 'spacing', 'width']].to_numpy(),
+            hovertemplate=hovertemplate
         ))
 
     fig.update_layout(
@@ -106,29 +147,51 @@ def create_budget_pow_fig(
         n_step=1, w_step=1, s_step=1,
         azimuth_range = (90, 270),  # front to back (side to side is symmetrical, front to back is not)
         elevation_range = (0, 90),
-        degree_step = 15
+        degree_step = 15,
+        max_budget = None
     ):
+    # swept fields are not part of the cache key
+    fixed = replace(config, num_panels=None, panel_width=None, panel_spacing=None)
+    max_power_budget_df = cached_max_power_budget(
+        astuple(fixed), tuple(num_range), tuple(width_range), tuple(spacing_range),
+        n_step, w_step, s_step, tuple(azimuth_range), tuple(elevation_range), degree_step,
+        max_budget
+    )
+    fig = pow_budget_fig(max_power_budget_df)
+    return fig
+
+def budget_ranges(num_range, width_range, spacing_range, n_step, w_step, s_step):
+    """sweep ranges of the budget analysis (the width and spacing maxima are exclusive)"""
+    return {
+        'num_panels': list(range(num_range[0], num_range[1]+1, n_step)),
+        'panel_width': list(np.arange(width_range[0], width_range[1], w_step)),
+        'panel_spacing': list(np.arange(spacing_range[0], spacing_range[1], s_step)),
+    }
+
+@lru_cache(maxsize=CACHE_SIZE)
+def cached_max_power_budget(config_key, num_range, width_range, spacing_range,
+                            n_step, w_step, s_step, azimuth_range, elevation_range, degree_step,
+                            max_budget=None):
+    """run the budget sweep for a config key, cached so repeated/warmed-up requests are free
+
+    configs that can't be the best at any budget are pruned without running their
+    sun sweep (see sweep.evaluate_pruned), they stay in the data with NaN power so
+    the budget range is unchanged
+    """
+    ranges = budget_ranges(num_range, width_range, spacing_range, n_step, w_step, s_step)
+    grid = engine.SunGrid.from_ranges(azimuth_range, elevation_range, degree_step)
 
     data = []
-    for num_panels in range(num_range[0], num_range[1]+1, n_step):
-        for width_panels in np.arange(width_range[0], width_range[1], w_step):
-            for space_panels in np.arange(spacing_range[0], spacing_range[1], s_step):
-                
-                config.num_panels = num_panels
-                config.panel_spacing = space_panels
-                config.panel_width = width_panels
-                stack = Stack(config)
-                
-                avg_power = calc_power(stack, azimuth_range, elevation_range, degree_step, avg=True)
-                data.append({'num': num_panels, 
-                             'width': width_panels, 
-                             'spacing': space_panels,
-                             'power': avg_power,
-                             'cost': stack.cost})
+    results = sweep.evaluate_pruned(StackConfig(*config_key), ranges, grid, max_budget)
+    for _, cfg, avg_power, cost in sorted(results, key=lambda r: r[0]):  # sweep order, ties resolve as before
+        data.append({'num': cfg.num_panels, 
+                     'width': cfg.panel_width, 
+                     'spacing': cfg.panel_spacing,
+                     'power': avg_power,
+                     'cost': cost})
+    import pandas as pd
     avg_power_cost_df = pd.DataFrame(data)
-    max_power_budget_df = max_power_budget(avg_power_cost_df)
-    fig = pow_budget_fig(max_power_budget_df)
-    return fig
+    return max_power_budget(avg_power_cost_df)
 
 def create_heatmap(
         stack,
@@ -137,7 +200,8 @@ def create_heatmap(
         degree_step = 1
     ):
 
-    df = calc_power(stack, azimuth_range, elevation_range, degree_step, avg=False)
+    df = cached_power_grid(stack.config_key, (stack.heel, stack.pitch, stack.heading), stack.irradiance_model,
+                           tuple(azimuth_range), tuple(elevation_range), degree_step)
 
     fig = go.Figure(data=go.Heatmap(
         z=df['power'],
@@ -155,6 +219,13 @@ def create_heatmap(
     
     return fig
 
+@lru_cache(maxsize=CACHE_SIZE)
+def cached_power_grid(config_key, attitude, irradiance_model, azimuth_range, elevation_range, degree_step):
+    """power for every sun position of a config key, (heel, pitch, heading) and irradiance model, cached for heatmaps"""
+    heel, pitch, heading = attitude
+    stack = Stack(StackConfig(*config_key), irradiance_model, heel=heel, pitch=pitch, heading=heading)
+    return calc_power(stack, azimuth_range, elevation_range, degree_step, avg=False)
+
 
 if __name__ == "__main__":
     default_config = StackConfig()
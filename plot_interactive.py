@@ -1,8 +1,10 @@
 import numpy as np
 import plotly.graph_objs as go
-import pandas as pd
 import plotly.graph_objects as go
 
+MAST_RADIUS = .3
+MAST_POSITION = .55  # mast center as a fraction of boat length
+
 
 def create_surface(x_coords, y_coords, z_coords, colorscale):
     """Create basic 3D plotly surface with x,y,z coordinates and color inputs"""
@@ -36,7 +38,7 @@ def rect_surfaces(rects, color):
         surfs.append(surf)
     return surfs
 
-def create_cylinder(panel_width, x_val, radius=.3, height=40, resolution=50):
+def create_cylinder(panel_width, x_val, radius=MAST_RADIUS, height=40, resolution=50):
     """Create a cylinder surface (sailboat mast)
     
     x_val: x position of cylinder center (based on boat length)
@@ -108,7 +110,7 @@ def create_deck(boat_length, width):
         opacity=.3
     )
 
-    mast_x = boat_length * .55
+    mast_x = boat_length * MAST_POSITION
     return deck_surface, mast_x
 
 
@@ -0,0 +1,262 @@
+"""Tilted, non-rectangular panels with batched convex polygon clipping.
+
+A PolygonPanel is any convex outline lying in a (possibly tilted) plane. The
+shadow of a panel on the one below is its outline projected along the sun
+vector onto the lower panel's plane, clipped against the lower outline
+(Sutherland-Hodgman). Clipping works on padded arrays of polygons, so every
+(sun position, panel pair) of a sweep is clipped in one batch of numpy
+operations instead of a Python loop per polygon.
+
+Shadow areas don't need the clipped polygon itself: rectangles in parallel
+planes (any Stack tilted as a whole) take a closed form box overlap, other
+outlines sum the parts of both boundaries inside the other polygon (Green's
+theorem), and only pairs where the upper panel is between the sun and the
+lower one are evaluated at all.
+"""
+import numpy as np
+
+import engine
+
+
+def polygon_area(vertices, counts=None):
+    """shoelace area of padded polygons (..., N, 2), only the first counts vertices are used"""
+    vertices = np.asarray(vertices, dtype=float)
+    if counts is not None:
+        valid = np.arange(vertices.shape[-2]) < np.asarray(counts)[..., None]
+        vertices = np.where(valid[..., None], vertices, vertices[..., :1, :])  # pad with the first vertex
+    x, y = vertices[..., 0], vertices[..., 1]
+    return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1) * y, axis=-1))
+
+
+def clip_convex(subject, clip, subject_counts=None):
+    """intersect batches of convex polygons
+
+    args:
+        subject: (B, N, 2) polygons to clip
+        clip: (B, C, 2) or (C, 2) convex clip polygons, counter-clockwise
+        subject_counts: (B,) number of valid subject vertices (default all N)
+
+    returns:
+        (vertices, counts): (B, N + C, 2) padded intersection polygons and their vertex counts
+    """
+    subject = np.asarray(subject, dtype=float)
+    clip = np.broadcast_to(np.asarray(clip, dtype=float), subject.shape[:1] + np.shape(clip)[-2:])
+    batch, n = subject.shape[:2]
+    size = n + clip.shape[1]
+    rows = np.arange(batch)[:, None]
+
+    polygon = np.zeros((batch, size, 2))
+    polygon[:, :n] = subject
+    counts = np.full(batch, n) if subject_counts is None else np.asarray(subject_counts).copy()
+
+    for k in range(clip.shape[1]):
+        a, b = clip[:, k], clip[:, (k + 1) % clip.shape[1]]
+        edge = (b - a)[:, None, :]
+
+        valid = np.arange(size)[None, :] < counts[:, None]
+        prev = polygon[rows, (np.arange(size)[None, :] - 1) % np.maximum(counts, 1)[:, None]]
+        side = edge[..., 0] * (polygon[..., 1] - a[:, None, 1]) - edge[..., 1] * (polygon[..., 0] - a[:, None, 0])
+        prev_side = edge[..., 0] * (prev[..., 1] - a[:, None, 1]) - edge[..., 1] * (prev[..., 0] - a[:, None, 0])
+        inside, prev_inside = side >= 0, prev_side >= 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = prev_side / (prev_side - side)
+            crossing = prev + t[..., None] * (polygon - prev)
+
+        # each vertex emits the edge crossing (if the edge crosses) then itself (if inside)
+        candidates = np.stack([crossing, polygon], axis=2).reshape(batch, 2 * size, 2)
+        keep = np.stack([valid & (inside != prev_inside), valid & inside], axis=2).reshape(batch, 2 * size)
+
+        # compact the kept candidates to the front of each row, unused slots stay 0 (finite)
+        position = np.cumsum(keep, axis=1) - 1
+        keep &= position < size
+        row, column = np.nonzero(keep)
+        polygon = np.zeros((batch, size, 2))
+        polygon[row, position[row, column]] = candidates[row, column]
+        counts = keep.sum(axis=1)
+
+    return polygon, counts
+
+
+def _inside_boundary(x, y, other_x, other_y, shared):
+    """sum of cross(start, end) over the parts of the edges of a polygon inside the convex polygon other
+
+    vertex coordinates are (vertices, batch) arrays, other's batch axis may be 1. edges
+    lying on an edge of other are kept when shared and both run the same way,
+    otherwise dropped (so a boundary both polygons share is only counted once)
+    """
+    dx, dy = np.roll(x, -1, axis=0) - x, np.roll(y, -1, axis=0) - y
+    shape = np.broadcast(x, other_x[0]).shape
+    low, high, outside = np.zeros(shape), np.ones(shape), np.zeros(shape, dtype=bool)
+
+    # clip the edges x + s * (dx, dy), 0 <= s <= 1, against the inside of every edge of other
+    for k in range(len(other_x)):
+        ex, ey = other_x[(k + 1) % len(other_x)] - other_x[k], other_y[(k + 1) % len(other_x)] - other_y[k]
+        side = ex * (y - other_y[k]) - ey * (x - other_x[k])
+        slope = ex * dy - ey * dx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = -side / slope
+        low = np.where(slope > 0, np.maximum(low, s), low)
+        high = np.where(slope < 0, np.minimum(high, s), high)
+        parallel_outside = (slope == 0) & (side <= 0)
+        if shared:
+            parallel_outside &= (side < 0) | (ex * dx + ey * dy <= 0)
+        outside |= parallel_outside
+
+    keep = (low < high) & ~outside
+    cross = (x + low * dx) * (y + high * dy) - (y + low * dy) * (x + high * dx)
+    return np.sum(np.where(keep, cross, 0), axis=0)
+
+
+def convex_intersection_area(subject, clip):
+    """area of the intersection of batches of convex polygons, without building it
+
+    args:
+        subject: (B, N, 2) convex polygons, counter-clockwise
+        clip: (B, C, 2) or (C, 2) convex polygons, counter-clockwise
+
+    the intersection's boundary is the part of each boundary inside the other
+    polygon, its area follows from the shoelace sum over those segments
+    """
+    subject, clip = np.asarray(subject, dtype=float), np.asarray(clip, dtype=float)
+    x, y = np.ascontiguousarray(subject[..., 0].T), np.ascontiguousarray(subject[..., 1].T)
+    clip = clip[..., None, :] if clip.ndim == 2 else np.moveaxis(clip, 0, -2)  # (C, B or 1, 2)
+    clip_x, clip_y = np.ascontiguousarray(clip[..., 0]), np.ascontiguousarray(clip[..., 1])
+    return .5 * (_inside_boundary(x, y, clip_x, clip_y, True) + _inside_boundary(clip_x, clip_y, x, y, False))
+
+
+class PolygonPanel:
+    """convex panel outline in a plane through center spanned by unit vectors u and v
+
+    outline: (V, 2) counter-clockwise vertices in (u, v) plane coordinates
+    """
+
+    def __init__(self, center, u, v, outline):
+        self.center = np.asarray(center, dtype=float)
+        self.u = np.asarray(u, dtype=float)
+        self.v = np.asarray(v, dtype=float)
+        self.normal = np.cross(self.u, self.v)
+        self.outline = np.asarray(outline, dtype=float)
+
+    @classmethod
+    def from_panel(cls, panel, roll=0, pitch=0, outline=None):
+        """tilted version of a flat Stack panel, rotated about its center
+
+        args:
+            roll: tilt about the boat's length axis (degrees)
+            pitch: tilt about the sideways axis (degrees, positive raises the +x edge)
+            outline: (V, 2) convex outline in units of the panel length/width, centered
+                on 0 (default the full rectangle)
+        """
+        r, p = np.radians(roll), np.radians(pitch)
+        u = np.array([np.cos(p), 0, np.sin(p)])
+        v = np.array([-np.sin(r) * np.sin(p), np.cos(r), np.sin(r) * np.cos(p)])
+        if outline is None:
+            outline = [(-.5, -.5), (.5, -.5), (.5, .5), (-.5, .5)]
+        outline = np.asarray(outline, dtype=float) * [panel.length, panel.width]
+        center = ((panel.x0 + panel.x1) / 2, (panel.y0 + panel.y1) / 2, panel.z)
+        return cls(center, u, v, outline)
+
+    def area(self):
+        """signed outline area, negative for a panel turned inside out (a Stack panel past the mast top)"""
+        x, y = self.outline[:, 0], self.outline[:, 1]
+        return float(0.5 * np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+    def vertices(self):
+        """(V, 3) outline vertices in boat coordinates"""
+        return self.center + self.outline[:, :1] * self.u + self.outline[:, 1:] * self.v
+
+
+class PolygonStack:
+    """stack of convex, possibly tilted panels where each panel shades the one below it"""
+
+    def __init__(self, panels, eff, irradiance_model):
+        self.panels = panels
+        self.eff = eff
+        self.irradiance_model = irradiance_model
+        self.areas = np.array([panel.area() for panel in panels])
+
+    @classmethod
+    def from_stack(cls, stack, roll=0, pitch=0, outline=None):
+        """the panels of a Stack, tilted and/or with a different outline"""
+        panels = [PolygonPanel.from_panel(panel, roll, pitch, outline) for panel in stack.panels]
+        return cls(panels, stack.eff, stack.irradiance_model)
+
+    def shadow_areas(self, dx, dy, dz):
+        """shadow area (ft^2) on every panel, shape (positions, panels), for arrays of sun vectors"""
+        sun = np.stack(np.broadcast_arrays(*(np.atleast_1d(c) for c in (dx, dy, dz))), axis=-1)
+        shadows = np.zeros((len(sun), len(self.panels)))
+        for i, (lower, upper) in enumerate(zip(self.panels[:-1], self.panels[1:])):
+            shadows[:, i] = _shadow_area(lower, upper, sun)
+        return shadows
+
+    def exposed_area(self, elevations, azimuths):
+        """unshaded area (m^2) at every sun position, each panel scaled by its incidence relative to a level one
+
+        power is exposed area * eff * irradiance, like engine.exposed_area of a flat stack
+        """
+        elevations = np.atleast_1d(np.asarray(elevations, dtype=float))
+        dx, dy, dz = engine.sun_direction(elevations, azimuths)
+        exposed = (self.areas - self.shadow_areas(dx, dy, dz)) * engine.FT2_TO_M2
+
+        up = elevations > 0
+        normals = np.array([p.normal for p in self.panels])
+        incidence = np.maximum(np.stack(np.broadcast_arrays(dx, dy, dz), axis=-1) @ normals.T, 0)
+        return np.sum(exposed * incidence, axis=1) / np.where(up, np.sin(np.radians(elevations)), 1)
+
+    def power(self, elevations, azimuths):
+        """truncated stack power for arrays of sun positions, each panel lit at its own incidence"""
+        elevations = np.atleast_1d(np.asarray(elevations, dtype=float))
+        return engine.power_from_area(self.exposed_area(elevations, azimuths), self.irradiance_model(elevations),
+                                      self.eff)
+
+
+def _box(outline):
+    """(low, high) corners of an outline that is a rectangle along the plane axes, else None"""
+    low, high = outline.min(axis=0), outline.max(axis=0)
+    corners = {(x, y) for x in (low[0], high[0]) for y in (low[1], high[1])}
+    if len(outline) == 4 and {tuple(vertex) for vertex in outline.tolist()} == corners:
+        return low, high
+    return None
+
+
+def _shadow_area(lower, upper, sun):
+    """area of upper's shadow on lower for (M, 3) sun vectors"""
+    facing = sun @ lower.normal
+    areas = np.zeros(len(sun))
+    if lower.area() <= 0 or upper.area() <= 0:
+        return areas  # like Stack, a panel turned inside out neither casts nor catches a shadow
+    parallel = np.array_equal(lower.u, upper.u) and np.array_equal(lower.v, upper.v)
+
+    if parallel:
+        # the projection is a shift within the plane, the same for every vertex
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.dot(lower.normal, lower.center - upper.center) / facing
+        # the upper panel has to sit between the sun and the lower panel
+        casts = np.flatnonzero((facing > 0) & (t <= 0))
+        offset = (upper.center - lower.center + t[casts, None] * sun[casts]) @ np.array([lower.u, lower.v]).T
+        lower_box, upper_box = _box(lower.outline), _box(upper.outline)
+        if lower_box is not None and upper_box is not None:
+            low = np.maximum(lower_box[0], upper_box[0] + offset)
+            high = np.minimum(lower_box[1], upper_box[1] + offset)
+            areas[casts] = np.prod(np.maximum(high - low, 0), axis=-1)
+            return areas
+        local = upper.outline + offset[:, None, :]
+    else:
+        vertices = upper.vertices()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((lower.center - vertices) @ lower.normal)[None, :] / facing[:, None]  # (M, V)
+            casts = np.flatnonzero((facing > 0) & np.all(t <= 0, axis=-1))
+            projected = vertices + t[casts, :, None] * sun[casts, None, :]
+        local = (projected - lower.center) @ np.array([lower.u, lower.v]).T
+
+    # only shadows whose bounding box overlaps the lower outline's can have an area
+    overlaps = np.all((local.min(axis=1) < lower.outline.max(axis=0)) &
+                      (local.max(axis=1) > lower.outline.min(axis=0)), axis=-1)
+    casts, local = casts[overlaps], local[overlaps]
+    # a panel facing away from the sun projects mirrored, keep every subject counter-clockwise
+    x, y = local[..., 0], local[..., 1]
+    clockwise = np.sum(x * np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1) * y, axis=-1) < 0
+    local = np.where(clockwise[:, None, None], local[:, ::-1], local)
+    areas[casts] = convex_intersection_area(local, lower.outline)
+    return areas
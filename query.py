@@ -0,0 +1,325 @@
+"""Indexed queries over stored sweep results, without running the engine again.
+
+A ResultIndex holds every config of a sweep with its cost, average power and
+power per sun elevation (averaged over the azimuths), plus a sorted order and
+the sorted values of each of those columns. Range bounds on an indexed column
+are two binary searches, the most selective bound picks the candidates and the
+other bounds filter them, so queries take milliseconds on millions of configs:
+
+    index = query.ResultIndex.build(StackConfig(), ranges, (90, 270), (15, 90), 10)
+    index.save('index.npz')                       # export.save, .arrow works too
+    index = query.ResultIndex.load('index.npz')   # memory mapped
+    rows = index.query({'cost': (None, 500), 'power@30': (200, None)}, sort='cost')
+    index.records(rows[:10])
+
+Indexed columns are 'cost', 'power' and 'power@<elevation>', config fields
+can be bounded too (scanned). With SOLAR_STACK_RESULT_INDEX pointing at a
+stored index the analysis page answers requests it covers from the index.
+
+    python query.py build spec.json -o index.npz
+    python query.py find index.npz --max-cost 500 --min-power-at 30 200 --sort cost --limit 20
+"""
+import argparse
+import itertools
+import json
+from dataclasses import asdict
+
+import numpy as np
+
+import batch
+import engine
+import export
+import sweep
+
+BATCH_CONFIGS = 256  # configs evaluated together while building
+BUDGET_FIELDS = ('num_panels', 'panel_width', 'panel_spacing')  # swept by the analysis page
+DECIMALS = 9  # config values are compared rounded, the analysis ranges come from np.arange
+
+
+def elevation_means(grid, power):
+    """(elevations, power averaged over the azimuths of each elevation), weighted like grid.mean"""
+    elevations, inverse = np.unique(grid.elevations, return_inverse=True)
+    means = np.empty(power.shape[:-1] + (len(elevations),))
+    for i in range(len(elevations)):
+        at = inverse.ravel() == i
+        if grid.weights is None:
+            means[..., i] = power[..., at].mean(axis=-1)
+        else:
+            weights = grid.weights[at]
+            means[..., i] = power[..., at] @ weights / weights.sum() if weights.sum() else 0
+    return elevations, means
+
+
+class ResultIndex:
+    """sweep results with sorted indexes on cost, average power and power per elevation"""
+
+    def __init__(self, arrays, metadata):
+        self.arrays = arrays
+        self.metadata = metadata
+        self.elevations = np.asarray(arrays['elevation'])
+        self.size = len(arrays['cost'])
+
+    @classmethod
+    def build(cls, base, ranges, azimuth_range, elevation_range, degree_step, grid=None,
+              batch_configs=BATCH_CONFIGS):
+        """evaluate every config of the sweep and index the results
+
+        grid defaults to the unweighted grid of the sun ranges (pass a climatology
+        weighted grid of the same ranges for time weighted powers)
+        """
+        grid = grid or engine.SunGrid.from_ranges(azimuth_range, elevation_range, degree_step)
+        total = sweep.sweep_size(ranges)
+        columns = {name: np.empty(total) for name in sweep.CONFIG_FIELDS + ['power', 'cost']}
+        elevations = np.unique(grid.elevations)
+        elevation_power = np.empty((len(elevations), total))
+
+        configs = sweep.iter_configs(base, ranges)
+        done = 0
+        while True:
+            chunk = [cfg for _, cfg in itertools.islice(configs, batch_configs)]
+            if not chunk:
+                break
+            values = {name: np.array([getattr(cfg, name) for cfg in chunk]) for name in sweep.CONFIG_FIELDS}
+            power = engine.configs_power(values, grid)
+            area = engine.configs_panel_area(values)
+            _, by_elevation = elevation_means(grid, power)
+
+            rows = slice(done, done + len(chunk))
+            for name in sweep.CONFIG_FIELDS:
+                columns[name][rows] = values[name]
+            columns['power'][rows] = grid.mean(power)
+            columns['cost'][rows] = engine.cost(area, values['panel_width'], values['cost_panel'],
+                                                values['cost_frame'])
+            elevation_power[:, rows] = by_elevation.T
+            done += len(chunk)
+
+        arrays = dict(columns, elevation=elevations, elevation_power=elevation_power)
+        arrays['num_panels'] = arrays['num_panels'].astype(np.int64)
+        arrays['cost'] = arrays['cost'].astype(np.int64)
+
+        # stable sorts, so equal values stay in sweep order
+        for key in ('cost', 'power'):
+            arrays[f'order_{key}'] = np.argsort(arrays[key], kind='stable')
+            arrays[f'sorted_{key}'] = arrays[key][arrays[f'order_{key}']]
+        arrays['order_elevation_power'] = np.argsort(elevation_power, axis=1, kind='stable')
+        arrays['sorted_elevation_power'] = np.take_along_axis(elevation_power, arrays['order_elevation_power'], 1)
+
+        metadata = {'kind': 'index', 'model_version': engine.MODEL_VERSION, 'base': asdict(base), 'ranges': ranges,
+                    'azimuth_range': list(azimuth_range), 'elevation_range': list(elevation_range),
+                    'degree_step': degree_step, 'weighted': grid.weights is not None}
+        return cls(arrays, metadata)
+
+    def save(self, path):
+        export.save(path, self.arrays, self.metadata)
+
+    @classmethod
+    def load(cls, path):
+        arrays, metadata = export.load(path)
+        if metadata.get('kind') != 'index':
+            raise ValueError(f"{path} holds {metadata.get('kind')!r} results, not a result index")
+        if metadata['model_version'] != engine.MODEL_VERSION:
+            raise ValueError(f"{path} was built by model version {metadata['model_version']}, "
+                             f"rebuild it for version {engine.MODEL_VERSION}")
+        return cls(arrays, metadata)
+
+    def _elevation_row(self, key):
+        elevation = float(key.split('@', 1)[1])
+        row = np.flatnonzero(np.isclose(self.elevations, elevation))
+        if not len(row):
+            raise KeyError(f"no elevation {elevation:g} in the index, it has {', '.join(f'{e:g}' for e in self.elevations)}")
+        return row[0]
+
+    def column(self, key):
+        """values of an indexed column ('cost', 'power', 'power@30') or a config field, over all configs"""
+        if key.startswith('power@'):
+            return self.arrays['elevation_power'][self._elevation_row(key)]
+        if key not in self.arrays or key.startswith(('order_', 'sorted_')) or key.startswith('elevation'):
+            raise KeyError(f"unknown column {key!r}")
+        return self.arrays[key]
+
+    def _sorted(self, key):
+        """(order, sorted values) of an indexed column, None for config fields"""
+        if key.startswith('power@'):
+            row = self._elevation_row(key)
+            return self.arrays['order_elevation_power'][row], self.arrays['sorted_elevation_power'][row]
+        if key in ('cost', 'power'):
+            return self.arrays[f'order_{key}'], self.arrays[f'sorted_{key}']
+        return None
+
+    def query(self, where=None, sort=None, descending=False, limit=None):
+        """row numbers of the configs within all bounds, optionally sorted by a column
+
+        args:
+            where: column -> (low, high) inclusive bounds, None for an open end
+            sort: column to sort by, ties keep sweep order (descending reverses the whole order)
+            limit: at most this many rows (top-k when sorted)
+        """
+        where = dict(where or {})
+        slices = {}
+        for key in list(where):
+            index = self._sorted(key)
+            if index is not None:
+                low, high = where[key]
+                start = 0 if low is None else np.searchsorted(index[1], low, side='left')
+                stop = len(index[1]) if high is None else np.searchsorted(index[1], high, side='right')
+                slices[key] = index[0][start:stop]
+
+        if slices:
+            key = min(slices, key=lambda k: len(slices[k]))
+            rows = np.sort(slices.pop(key))
+            where.pop(key)
+        elif sort is not None and self._sorted(sort) is not None and not where:
+            order = self._sorted(sort)[0]
+            order = order[::-1] if descending else order
+            return np.asarray(order[:limit])
+        else:
+            rows = np.arange(self.size)
+
+        for key, (low, high) in where.items():
+            values = self.column(key)[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            rows = rows[keep]
+
+        if sort is not None:
+            values = self.column(sort)[rows]
+            rows = rows[np.lexsort((-rows, -values) if descending else (rows, values))]
+        return rows[:limit]
+
+    def top(self, key, k=10, where=None, lowest=False):
+        """the k rows with the highest (or lowest) values of key within the bounds"""
+        return self.query(where, sort=key, descending=not lowest, limit=k)
+
+    def records(self, rows, columns=None):
+        """list of dicts (config fields, cost, power and the requested columns) for row numbers"""
+        columns = list(sweep.CONFIG_FIELDS) + ['cost', 'power'] + list(columns or [])
+        values = {key: self.column(key)[rows] for key in columns}
+        return [dict({key: values[key][i].item() for key in columns}, row=int(row)) for i, row in enumerate(rows)]
+
+    def budget_frontier(self, rows, n_budget_samples=50, tie_order=None):
+        """max power within each budget over the given rows, like plot_analysis.max_power_budget
+
+        tie_order: rank of every row among equal powers (default the row order), the first wins
+        """
+        import pandas as pd
+        if not len(rows):
+            return pd.DataFrame(columns=['budget', 'max_P', 'num', 'width', 'spacing'])
+        cost = np.asarray(self.column('cost')[rows], dtype=float)
+        power = np.asarray(self.column('power')[rows])
+        tie_order = np.arange(len(rows)) if tie_order is None else tie_order
+
+        # best row within a budget: minimum rank by (power descending, tie order) among the affordable rows
+        by_rank = np.lexsort((tie_order, -power))
+        rank = np.empty(len(rows), dtype=np.int64)
+        rank[by_rank] = np.arange(len(rows))
+        by_cost = np.argsort(cost, kind='stable')
+        best_rank = np.minimum.accumulate(rank[by_cost])
+
+        budgets = np.linspace(cost.min(), cost.max(), n_budget_samples)
+        affordable = np.searchsorted(cost[by_cost], budgets, side='right')
+        results = []
+        seen = set()
+        for budget, count in zip(budgets, affordable):
+            if not count:
+                continue
+            best = by_rank[best_rank[count - 1]]
+            if power[best] in seen:
+                continue
+            seen.add(power[best])
+            row = rows[best]
+            results.append({'budget': budget, 'max_P': power[best],
+                            'num': float(self.arrays['num_panels'][row]),
+                            'width': float(self.arrays['panel_width'][row]),
+                            'spacing': float(self.arrays['panel_spacing'][row])})
+        return pd.DataFrame(results)
+
+    def analysis_rows(self, config, num_range, width_range, spacing_range, n_step=1, w_step=1, s_step=1,
+                      azimuth_range=(90, 270), elevation_range=(0, 90), degree_step=15):
+        """row numbers of create_budget_pow_fig's sweep in its order, None unless the index holds all of it"""
+        meta = self.metadata
+        if (meta['weighted'] or list(azimuth_range) != meta['azimuth_range']
+                or list(elevation_range) != meta['elevation_range'] or degree_step != meta['degree_step']):
+            return None
+        import plot_analysis
+        try:
+            ranges = plot_analysis.budget_ranges(num_range, width_range, spacing_range, n_step, w_step, s_step)
+        except TypeError:  # an empty input
+            return None
+
+        keep = np.ones(self.size, dtype=bool)
+        for name in sweep.CONFIG_FIELDS:
+            column = np.round(np.asarray(self.arrays[name], dtype=float), DECIMALS)
+            if name in BUDGET_FIELDS:
+                keep &= np.isin(column, np.round(np.asarray(ranges[name], dtype=float), DECIMALS))
+            else:
+                keep &= column == round(float(getattr(config, name)), DECIMALS)
+        rows = np.flatnonzero(keep)
+        if len(rows) != np.prod([len(values) for values in ranges.values()]):
+            return None  # missing or duplicated configs
+        # analysis sweep order: panels, then width, then spacing
+        order = np.lexsort(tuple(np.asarray(self.arrays[name])[rows] for name in reversed(BUDGET_FIELDS)))
+        return rows[order]
+
+
+def index_from_spec(spec):
+    """ResultIndex of a sweep spec (see batch.py)"""
+    if batch.panel_options(spec):
+        raise SystemExit("indexes hold flat rectangular panels, run tilted or outlined panels with batch.py")
+    base, ranges, grid = batch.sweep_setup(spec)
+    return ResultIndex.build(base, ranges, spec['azimuth_range'], spec['elevation_range'], spec['degree_step'],
+                             grid=grid)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build and query indexes of stack design sweep results")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('build', help="evaluate a sweep spec into an index file")
+    p.add_argument('spec')
+    p.add_argument('-o', '--output', required=True, help=".npz or .arrow")
+
+    p = commands.add_parser('find', help="query an index file, one json line per config")
+    p.add_argument('index')
+    p.add_argument('--max-cost', type=float)
+    p.add_argument('--min-power', type=float)
+    p.add_argument('--min-power-at', type=float, nargs=2, action='append', default=[], metavar=('ELEVATION', 'WATTS'))
+    p.add_argument('--where', action='append', default=[], metavar='COLUMN=LOW:HIGH',
+                   help="bound any column or config field, e.g. num_panels=4:6 or power@60=300:")
+    p.add_argument('--sort', default='cost')
+    p.add_argument('--descending', action='store_true')
+    p.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        index = index_from_spec(batch.load_spec(args.spec))
+        index.save(args.output)
+        print(f"{index.size} configs")
+        return
+
+    index = ResultIndex.load(args.index)
+    where = {}
+    if args.max_cost is not None:
+        where['cost'] = (None, args.max_cost)
+    if args.min_power is not None:
+        where['power'] = (args.min_power, None)
+    for elevation, watts in args.min_power_at:
+        where[f'power@{elevation:g}'] = (watts, None)
+    for bound in args.where:
+        key, _, limits = bound.partition('=')
+        low, _, high = limits.partition(':')
+        where[key] = (float(low) if low else None, float(high) if high else None)
+
+    extra = [key for key in where if key.startswith('power@')]
+    try:
+        rows = index.query(where, sort=args.sort, descending=args.descending, limit=args.limit)
+    except KeyError as error:
+        raise SystemExit(error.args[0])
+    for record in index.records(rows, extra):
+        print(json.dumps(record))
+
+
+if __name__ == '__main__':
+    main()
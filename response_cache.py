@@ -0,0 +1,161 @@
+"""Serialized response cache and gzip compression for the app's Flask server.
+
+Most callback outputs here only depend on the callback inputs, so the serialized
+JSON of an update response can be reused for every later request with the same
+inputs: the figure is neither rebuilt nor re-serialized. Callbacks whose answer
+also depends on server state (busy, coarsened or rejected analyses, see
+admission.py) call uncacheable() for that response. Entries are keyed by
+the callback output and its input values, with inputs that only select a view
+normalized (plot-toggle-button clicks only matter through their parity, the 3D
+view or the heatmap). The cache keeps the gzip compressed body next to the raw
+one, so a hit costs no compression either.
+
+Other JSON and HTML responses are gzip compressed when the client accepts it,
+and plotly serializes figures with orjson when it is installed.
+
+    response_cache.install(app.server)
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import flask
+
+UPDATE_PATH = '/_dash-update-component'
+MAX_BYTES = 64 * 2 ** 20  # raw + compressed bytes kept per process
+COMPRESS_MIN_BYTES = 1024  # smaller responses are sent as they are
+COMPRESS_LEVEL = 6
+COMPRESSED_TYPES = ('application/json', 'text/html')
+# inputs that only matter through part of their value
+NORMALIZE = {('plot-toggle-button', 'n_clicks'): lambda clicks: (clicks or 0) % 2}
+
+
+class ResponseCache:
+    """thread safe LRU of response bodies (raw and gzipped) bounded by total size"""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (body, compressed body)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body):
+        """store body, returns the entry (body, compressed body)"""
+        entry = (body, gzip.compress(body, COMPRESS_LEVEL))
+        entry_size = len(entry[0]) + len(entry[1])
+        if entry_size > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                old = self._entries.pop(key)
+                self.size -= len(old[0]) + len(old[1])
+            self._entries[key] = entry
+            self.size += entry_size
+            while self.size > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.size -= len(old[0]) + len(old[1])
+        return entry
+
+
+def request_key(payload):
+    """cache key of an update request: the outputs plus the (normalized) input and state values"""
+    def values(items):
+        items = items or []
+        result = []
+        for item in items:
+            if isinstance(item, list):  # pattern matching inputs come as lists
+                result.append(values(item))
+                continue
+            component = item.get('id')
+            normalize = NORMALIZE.get((component, item.get('property'))) if isinstance(component, str) else None
+            value = normalize(item.get('value')) if normalize else item.get('value')
+            result.append([item.get('id'), item.get('property'), value])
+        return result
+
+    key = [payload.get('output'), values(payload.get('inputs')), values(payload.get('state'))]
+    return hashlib.sha256(json.dumps(key, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def _accepts_gzip():
+    return 'gzip' in flask.request.headers.get('Accept-Encoding', '')
+
+
+def _send(response, body, compressed):
+    """set the response body, gzipped if the client takes it"""
+    if compressed is not None and _accepts_gzip():
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response.set_data(body)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def uncacheable():
+    """keep the response of the current update request out of the cache (e.g. a busy message)"""
+    flask.g.pop('response_cache_key', None)
+
+
+def use_fast_json():
+    """serialize figures with orjson when it is installed (plotly falls back to json otherwise)"""
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        return False
+    import plotly.io as pio
+    pio.json.config.default_engine = 'orjson'
+    return True
+
+
+def install(server, cache=None, compress=True):
+    """add the response cache (and compression) to a Flask server, returns the cache"""
+    cache = cache or ResponseCache()
+
+    @server.before_request
+    def serve_cached():
+        if flask.request.method != 'POST' or flask.request.path != UPDATE_PATH:
+            return None
+        payload = flask.request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return None
+        flask.g.response_cache_key = key = request_key(payload)
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        flask.g.response_cache_hit = True
+        body, compressed = entry
+        return _send(flask.Response(mimetype='application/json'), body, compressed if compress else None)
+
+    @server.after_request
+    def store_and_compress(response):
+        if flask.g.get('response_cache_hit') or response.direct_passthrough:
+            return response
+        if 'Content-Encoding' in response.headers or response.status_code != 200:
+            return response
+
+        key = flask.g.get('response_cache_key')
+        if key is not None:
+            body, compressed = cache.put(key, response.get_data())
+            return _send(response, body, compressed if compress else None)
+        if compress and response.mimetype in COMPRESSED_TYPES:
+            body = response.get_data()
+            if len(body) >= COMPRESS_MIN_BYTES:
+                return _send(response, body, gzip.compress(body, COMPRESS_LEVEL))
+        return response
+
+    use_fast_json()
+    return cache
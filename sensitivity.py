@@ -0,0 +1,90 @@
+"""Sensitivity of average power and cost to every StackConfig field.
+
+Every field is nudged up and down by its step (central differences, forward
+only where the step down would leave the valid range), and the base config and
+all perturbed configs are evaluated together in one vectorized pass
+(engine.configs_average_power), instead of one sweep per question.
+
+    rows = sensitivity(StackConfig(), engine.SunGrid.from_ranges((90, 270), (15, 90), 10))
+    rows[0]  # {'field': 'panel_width', 'step': .25, 'power': 41.2, 'cost': 23.0, ...}
+"""
+from dataclasses import astuple, fields, replace
+from functools import lru_cache
+
+import numpy as np
+
+import engine
+from stack import StackConfig
+
+# change in each field the sensitivities are reported per
+FIELD_STEPS = {
+    'num_panels': 1,
+    'panel_spacing': .25,
+    'panel_width': .25,
+    'boat_length': 1,
+    'base_mast_offset': .25,
+    'base_length': .25,
+    'base_height': .25,
+    'eff': .01,
+    'cost_panel': 1,
+    'cost_frame': 1,
+    'mast_h_boat_l_ratio': .05,
+}
+MIN_VALUES = {'num_panels': 1}  # smallest valid value, 0 for the other fields
+POSITIVE_FIELDS = ('panel_width', 'boat_length', 'mast_h_boat_l_ratio')  # must stay > 0
+CACHE_SIZE = 256
+
+
+def _can_step_down(name, value, step):
+    lower = value - step
+    return lower > 0 if name in POSITIVE_FIELDS else lower >= MIN_VALUES.get(name, 0)
+
+
+def sensitivity(config, grid, steps=None):
+    """finite difference sensitivities of average power (over grid) and cost to each field
+
+    args:
+        config: StackConfig to evaluate around
+        grid: engine.SunGrid the average power is taken over
+        steps: field -> step, defaults to FIELD_STEPS
+
+    returns:
+        list of dicts ranked by the size of the power change, with the field, its step,
+        power and cost (change per step), d_power and d_cost (change per unit of the field)
+    """
+    steps = steps or FIELD_STEPS
+    configs = [config]
+    plan = []  # (field, step, index of the + config, index of the - config or None)
+    for name, step in steps.items():
+        value = getattr(config, name)
+        configs.append(replace(config, **{name: value + step}))
+        up, down = len(configs) - 1, None
+        if _can_step_down(name, value, step):
+            configs.append(replace(config, **{name: value - step}))
+            down = len(configs) - 1
+        plan.append((name, step, up, down))
+
+    columns = {f.name: np.array([getattr(cfg, f.name) for cfg in configs]) for f in fields(StackConfig)}
+    power = engine.configs_average_power(columns, grid)
+    area = engine.configs_panel_area(columns)
+    cost = engine.cost(area, columns['panel_width'], columns['cost_panel'], columns['cost_frame'])
+
+    rows = []
+    for name, step, up, down in plan:
+        low, span = (down, 2) if down is not None else (0, 1)
+        d_power = (power[up] - power[low]) / (span * step)
+        d_cost = (cost[up] - cost[low]) / (span * step)
+        rows.append({'field': name, 'step': step, 'power': float(d_power * step), 'cost': float(d_cost * step),
+                     'd_power': float(d_power), 'd_cost': float(d_cost)})
+    return sorted(rows, key=lambda row: (-abs(row['power']), -abs(row['cost'])))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def cached_sensitivity(config_key, azimuth_range, elevation_range, degree_step):
+    """sensitivity for a config given as astuple(config), over the sun ranges, cached"""
+    grid = engine.SunGrid.from_ranges(azimuth_range, elevation_range, degree_step)
+    return sensitivity(StackConfig(*config_key), grid)
+
+
+def config_sensitivity(config, azimuth_range=(90, 270), elevation_range=(15, 90), degree_step=10):
+    return cached_sensitivity(astuple(config), tuple(azimuth_range), tuple(elevation_range), degree_step)
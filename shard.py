@@ -0,0 +1,279 @@
+"""Shard a design sweep over many hosts through a queue directory on a shared filesystem.
+
+The coordinator splits the sweep into units of consecutive configs, one file per
+unit. Workers on any host claim a unit by renaming its file, which is atomic, so
+no broker or lock server is needed:
+
+    queue/spec.json                     the sweep spec (see batch.py) and unit size
+    queue/todo/unit-000042              unit waiting for a worker
+    queue/claimed/unit-000042.<worker>  unit being evaluated, mtime is the claim time
+    queue/done/unit-000042.csv          rows of the finished unit
+
+A claim older than the timeout is moved back to todo/ by the next idle worker,
+so units of a crashed host are picked up again. A unit finished twice writes
+the same rows twice (atomically), and merge concatenates the units in order,
+so the merged output is identical to a single batch.py run.
+
+    python shard.py init spec.json queue/ --unit-size 1024
+    python shard.py work queue/ --processes 8          (on every host)
+    python shard.py status queue/
+    python shard.py merge queue/ -o results.csv
+
+    python shard.py local spec.json -o results.csv --processes 4   (all of the above on one host)
+    python shard.py check               (claim/requeue race checks in a temporary queue)
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import batch
+import sweep
+
+UNIT_PREFIX = 'unit-'
+CLAIM_TIMEOUT = 900  # seconds before a claimed unit counts as lost
+POLL_INTERVAL = 5  # seconds idle workers wait before checking for lost units again
+
+
+def _unit_name(unit):
+    return f"{UNIT_PREFIX}{unit:06d}"
+
+
+def _unit_number(name):
+    return int(name[len(UNIT_PREFIX):len(UNIT_PREFIX) + 6])
+
+
+def init(spec, queue, unit_size=1024):
+    """create the queue directory with one todo file per unit of unit_size configs"""
+    total = sweep.sweep_size(spec['ranges'])
+    for sub in ('todo', 'claimed', 'done'):
+        os.makedirs(os.path.join(queue, sub), exist_ok=True)
+    if os.listdir(os.path.join(queue, 'done')) or os.listdir(os.path.join(queue, 'claimed')):
+        raise SystemExit(f"{queue} already holds a started sweep")
+
+    with open(os.path.join(queue, 'spec.json'), 'w') as f:
+        json.dump({'spec': spec, 'unit_size': unit_size, 'total': total}, f)
+    for unit, start in enumerate(range(0, total, unit_size)):
+        with open(os.path.join(queue, 'todo', _unit_name(unit)), 'w') as f:
+            json.dump({'start': start, 'count': min(unit_size, total - start)}, f)
+    return -(-total // unit_size)
+
+
+def read_queue(queue):
+    with open(os.path.join(queue, 'spec.json')) as f:
+        return json.load(f)
+
+
+def claim(queue, worker):
+    """atomically take one todo unit, returns (unit, claim path) or None when todo/ is empty"""
+    for name in sorted(os.listdir(os.path.join(queue, 'todo'))):
+        todo = os.path.join(queue, 'todo', name)
+        claimed = os.path.join(queue, 'claimed', f"{name}.{worker}")
+        try:
+            # rename keeps the mtime, so stamp the claim time first: a claim must never
+            # show up in claimed/ with its old init time, or requeue_lost takes it back
+            os.utime(todo)
+            os.rename(todo, claimed)
+        except FileNotFoundError:
+            continue  # another worker was faster
+        return _unit_number(name), claimed
+    return None
+
+
+def requeue_lost(queue, timeout=CLAIM_TIMEOUT):
+    """move claims older than timeout back to todo/, returns the number moved"""
+    moved = 0
+    now = time.time()
+    for name in os.listdir(os.path.join(queue, 'claimed')):
+        path = os.path.join(queue, 'claimed', name)
+        try:
+            if now - os.path.getmtime(path) > timeout:
+                os.rename(path, os.path.join(queue, 'todo', name.split('.')[0]))
+                moved += 1
+        except FileNotFoundError:
+            pass  # finished or requeued meanwhile
+    return moved
+
+
+def _write_rows(queue, unit, rows):
+    """atomically publish the rows of a finished unit"""
+    done = os.path.join(queue, 'done')
+    fd, tmp = tempfile.mkstemp(dir=done, prefix='.tmp-')
+    with os.fdopen(fd, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+    os.replace(tmp, os.path.join(done, _unit_name(unit) + '.csv'))
+
+
+def work(queue, worker=None, timeout=CLAIM_TIMEOUT, poll=POLL_INTERVAL, log=sys.stderr):
+    """claim and evaluate units until every unit is done, returns the number of units evaluated"""
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    state = read_queue(queue)
+    setup = batch.sweep_setup(state['spec'])
+    panels = batch.panel_options(state['spec'])
+    n_units = -(-state['total'] // state['unit_size'])
+    evaluated = 0
+
+    while True:
+        claimed = claim(queue, worker)
+        if claimed is None:
+            if status(queue)['done'] >= n_units and not _pending(queue):
+                return evaluated
+            if not requeue_lost(queue, timeout):
+                time.sleep(poll)
+            continue
+
+        unit, path = claimed
+        if not os.path.exists(os.path.join(queue, 'done', _unit_name(unit) + '.csv')):
+            start = unit * state['unit_size']
+            rows = batch.sweep_rows(*setup, start, min(state['unit_size'], state['total'] - start), **panels)
+            _write_rows(queue, unit, rows)
+            evaluated += 1
+            print(f"{worker}: unit {unit} ({len(rows)} configs)", file=log)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # requeued while we were working, whoever claims it again will find it done
+
+
+def _pending(queue):
+    """units still in todo/ or claimed/"""
+    return [name for sub in ('todo', 'claimed') for name in os.listdir(os.path.join(queue, sub))
+            if name.startswith(UNIT_PREFIX)]
+
+
+def status(queue):
+    """counts of todo, claimed and done units"""
+    return {sub: sum(name.startswith(UNIT_PREFIX) for name in os.listdir(os.path.join(queue, sub)))
+            for sub in ('todo', 'claimed', 'done')}
+
+
+def merge(queue, output):
+    """concatenate the finished units in unit order into one csv, same rows as batch.py"""
+    state = read_queue(queue)
+    n_units = -(-state['total'] // state['unit_size'])
+    missing = [unit for unit in range(n_units)
+               if not os.path.exists(os.path.join(queue, 'done', _unit_name(unit) + '.csv'))]
+    if missing:
+        raise SystemExit(f"{len(missing)} units are not finished yet (first: {missing[0]})")
+
+    with open(output, 'w', newline='') as out:
+        csv.writer(out).writerow(batch.COLUMNS)
+        for unit in range(n_units):
+            with open(os.path.join(queue, 'done', _unit_name(unit) + '.csv'), newline='') as f:
+                out.write(f.read())
+
+
+def _work_process(queue, timeout, poll):
+    work(queue, timeout=timeout, poll=poll)
+
+
+def local(spec, output, queue=None, processes=None, unit_size=1024, timeout=CLAIM_TIMEOUT):
+    """run the whole sharded pipeline with worker processes on this host"""
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = queue or os.path.join(tmp, 'queue')
+        if not os.path.exists(os.path.join(queue, 'spec.json')):
+            init(spec, queue, unit_size)
+        workers = [multiprocessing.Process(target=_work_process, args=(queue, timeout, .1))
+                   for _ in range(processes or os.cpu_count())]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        merge(queue, output)
+
+
+def check(log=sys.stdout):
+    """claim/requeue races in a temporary queue, returns True when every check passes"""
+    results = []
+    rename = os.rename
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = os.path.join(tmp, 'queue')
+        init({'ranges': {}}, queue, unit_size=1)
+        todo = os.path.join(queue, 'todo', _unit_name(0))
+        os.utime(todo, (0, 0))  # a sweep that has run for longer than the claim timeout
+
+        def rename_then_requeue(source, target):
+            # another idle worker looks for lost claims right after our rename
+            rename(source, target)
+            if os.path.dirname(target).endswith('claimed'):
+                requeue_lost(queue, timeout=60)
+
+        os.rename = rename_then_requeue
+        try:
+            claimed = claim(queue, 'a')
+        except FileNotFoundError:
+            claimed = None
+        finally:
+            os.rename = rename
+        results.append(('fresh claim survives a requeue after the rename',
+                        claimed is not None and os.path.exists(claimed[1]) and not os.path.exists(todo)))
+
+        if results[-1][1]:
+            os.utime(claimed[1], (0, 0))  # its worker died long ago
+        results.append(('stale claim is requeued', bool(requeue_lost(queue, timeout=60)) and os.path.exists(todo)))
+        results.append(('requeued unit is claimed again', claim(queue, 'b') is not None))
+
+    for name, passed in results:
+        print(f"{name:<52}{'ok' if passed else 'FAIL'}", file=log)
+    return all(passed for _, passed in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="shard a stack design sweep over a shared queue directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('init', help="split a sweep spec into units")
+    p.add_argument('spec')
+    p.add_argument('queue')
+    p.add_argument('--unit-size', type=int, default=1024, help="configs per unit")
+
+    p = commands.add_parser('work', help="evaluate units until the sweep is done")
+    p.add_argument('queue')
+    p.add_argument('--processes', type=int, default=1, help="worker processes on this host")
+    p.add_argument('--timeout', type=float, default=CLAIM_TIMEOUT, help="seconds before a claim counts as lost")
+
+    p = commands.add_parser('status', help="count todo/claimed/done units")
+    p.add_argument('queue')
+
+    p = commands.add_parser('merge', help="merge finished units into one csv")
+    p.add_argument('queue')
+    p.add_argument('-o', '--output', required=True)
+
+    p = commands.add_parser('local', help="init, work and merge on this host")
+    p.add_argument('spec')
+    p.add_argument('-o', '--output', required=True)
+    p.add_argument('--queue', help="keep the queue here (default: a temporary directory)")
+    p.add_argument('--processes', type=int, default=None, help="worker processes (default: all cpus)")
+    p.add_argument('--unit-size', type=int, default=1024)
+    p.add_argument('--timeout', type=float, default=CLAIM_TIMEOUT)
+
+    commands.add_parser('check', help="run the claim/requeue race checks")
+    args = parser.parse_args(argv)
+
+    if args.command == 'init':
+        print(f"{init(batch.load_spec(args.spec), args.queue, args.unit_size)} units")
+    elif args.command == 'work':
+        workers = [multiprocessing.Process(target=_work_process, args=(args.queue, args.timeout, POLL_INTERVAL))
+                   for _ in range(args.processes)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+    elif args.command == 'status':
+        print(status(args.queue))
+    elif args.command == 'merge':
+        merge(args.queue, args.output)
+    elif args.command == 'check':
+        if not check():
+            sys.exit(1)
+    else:
+        local(batch.load_spec(args.spec), args.output, args.queue, args.processes, args.unit_size, args.timeout)
+
+
+if __name__ == '__main__':
+    main()
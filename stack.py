@@ -1,7 +1,9 @@
 import plotly.graph_objs as go
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, astuple, replace
 import plot_interactive
+import irradiance
+import attitude
 
 @dataclass
 class StackConfig:
@@ -46,7 +48,12 @@ class Panel:
         return f"Panel(width={round(self.width, 1)}, length={round(self.length,1)}, height={round(self.z, 1)})"
         
 class Stack:
-    def __init__(self, config):
+    def __init__(self, config, irradiance_model=None, heel=0, pitch=0, heading=0):
+        self.config = replace(config)  # private copy, callers may keep mutating theirs
+        self.irradiance_model = irradiance_model or irradiance.DEFAULT_MODEL
+        self.heel = heel  # boat attitude in degrees, see attitude.py
+        self.pitch = pitch
+        self.heading = heading
         self.num_panels = config.num_panels
         self.panel_spacing = config.panel_spacing
         self.panel_width = config.panel_width
@@ -138,11 +145,12 @@ class Stack:
 
     def _update_shadows(self): 
         """update the shadow locations based on sun position relative to panel stack"""   
-        if self.elevation <= 0: 
-            return   
-          
         self.shadows = []
 
+        # sun below the horizon, or behind the panels of a heeled boat
+        if self.elevation <= 0 or self.sun_direction_vector[2] <= 0: 
+            return   
+
         for i in range(len(self.panels) - 1):
             lower_panel = self.panels[i]
             upper_panel = self.panels[i+1]
@@ -166,6 +174,10 @@ class Stack:
         dy = np.cos(phi) * np.cos(theta)
         dz = np.sin(phi)
 
+        if not self.level:
+            # the panels move with the boat, so express the sun in the boat frame
+            dx, dy, dz = (float(v) for v in attitude.to_boat_frame(dx, dy, dz, self.heel, self.pitch, self.heading))
+
         # update sun direction vector and sun angles
         self.sun_direction_vector = (dx, dy, dz)
         self.elevation = elevation
@@ -201,29 +213,34 @@ class Stack:
         
         return lines
     
+    @property
+    def config_key(self):
+        """hashable key of the config this stack was built from (used for result caches)"""
+        return astuple(self.config)
+
     @property
     def total_shadow_area(self):
         return sum(shadow.area() for shadow in self.shadows)
   
     @property
     def solar_irradiance(self):
-        """calculate solar irradiance based on elevation"""
-        if self.elevation == 0: 
-            return 0
-
-        solar_constant = 1361  # W/m²  
-        elev_rad = np.radians(self.elevation)
-        air_mass = 1 / np.sin(elev_rad)
-        irradiance = solar_constant * np.sin(elev_rad) * 0.7 ** (air_mass ** 0.678)
-
-        return irradiance
+        """calculate solar irradiance based on elevation (see irradiance.py for the models)"""
+        return self.irradiance_model.scalar(self.elevation)
 
     @property
     def power(self):
         """calculate total power of stack with current sun position"""
         exposed_area = (self.total_panel_area - self.total_shadow_area) * 0.092903  # convert ft^2 to m^2        
         power = exposed_area * self.eff * self.solar_irradiance
+        if not self.level and self.elevation > 0:
+            # beam hits the tilted panels at the boat frame sun height instead of sin(elevation)
+            power = power * max(self.sun_direction_vector[2], 0) / np.sin(np.radians(self.elevation))
         return int(power)
+
+    @property
+    def level(self):
+        """True when the boat has no heel, pitch or heading"""
+        return self.heel == 0 and self.pitch == 0 and self.heading == 0
     
     @property
     def cost(self):
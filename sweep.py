@@ -0,0 +1,177 @@
+"""Enumerate StackConfigs over ranges of any of their fields.
+
+A sweep is described by a base config and a dict of field -> values, where the
+values are either an explicit list or an inclusive {"start", "stop", "step"} range:
+
+    ranges = {
+        'num_panels': {'start': 3, 'stop': 7, 'step': 1},
+        'panel_width': [1, 1.5, 2],
+        'eff': [.15, .2],
+    }
+
+Configs are enumerated as the product of the ranges in the given order, except
+that fields which only scale the results (eff and the costs) always vary
+fastest. evaluate() uses that to compute the geometry once and vectorize over
+the scaling fields.
+"""
+import itertools
+import math
+from dataclasses import fields, replace
+
+import numpy as np
+
+import engine
+import polygons
+from stack import Stack, StackConfig
+
+CONFIG_FIELDS = [f.name for f in fields(StackConfig)]
+SCALING_FIELDS = ('eff', 'cost_panel', 'cost_frame')  # don't change the panel geometry
+
+
+def field_values(spec):
+    """expand one field spec (list or inclusive start/stop/step range) into a list of values"""
+    if isinstance(spec, dict):
+        start, stop, step = spec['start'], spec['stop'], spec.get('step', 1)
+        if step <= 0:
+            raise ValueError(f"step must be positive, got {step}")
+        n = math.floor((stop - start) / step + 1e-9) + 1
+        values = [round(start + i * step, 10) for i in range(max(n, 0))]
+        if all(isinstance(v, int) for v in (start, stop, step)):
+            values = [int(v) for v in values]
+        return values
+    if isinstance(spec, (list, tuple)):
+        return list(spec)
+    return [spec]
+
+
+def expand_ranges(ranges):
+    """expand every field spec in sweep order (scaling fields last), checking the field names"""
+    unknown = set(ranges) - set(CONFIG_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown StackConfig fields: {', '.join(sorted(unknown))}")
+    names = sorted(ranges, key=lambda name: name in SCALING_FIELDS)  # stable sort keeps the given order
+    return {name: field_values(ranges[name]) for name in names}
+
+
+def sweep_size(ranges):
+    """number of configs in the sweep"""
+    return math.prod(len(values) for values in expand_ranges(ranges).values())
+
+
+def iter_configs(base, ranges, start=0):
+    """lazily yield (index, config) for every combination of the ranges
+
+    configs are new objects, base is never mutated. start skips the first
+    configs (used to resume a partially finished sweep)
+    """
+    expanded = expand_ranges(ranges)
+    names = list(expanded)
+    combos = itertools.product(*expanded.values())
+
+    for index, values in enumerate(itertools.islice(combos, start, None), start):
+        yield index, replace(base, **dict(zip(names, values)))
+
+
+def evaluate(base, ranges, grid, start=0, roll=0, pitch=0, outline=None):
+    """lazily yield (index, config, avg_power, cost) for every config of the sweep
+
+    args:
+        base: StackConfig with the values of the fields that are not swept (not mutated)
+        ranges: field specs, see module docstring
+        grid: engine.SunGrid the average power is taken over
+        start: index of the first config to evaluate (to resume or shard a sweep)
+        roll, pitch, outline: tilt and outline of every panel (see polygons.PolygonPanel.from_panel),
+            the defaults are the flat rectangles of Stack
+
+    the stack geometry is built once per combination of the geometry fields,
+    all eff/cost combinations of that geometry are evaluated as arrays
+    """
+    expanded = expand_ranges(ranges)
+    geometry = {name: values for name, values in expanded.items() if name not in SCALING_FIELDS}
+    scaling = {name: values for name, values in expanded.items() if name in SCALING_FIELDS}
+
+    # every eff/cost combination, as columns over the combinations
+    combos = list(itertools.product(*scaling.values()))
+    columns = {name: np.array([combo[i] for combo in combos], dtype=float)
+               for i, name in enumerate(scaling)}
+    effs, eff_index = np.unique(columns.get('eff', [base.eff]), return_inverse=True)
+    cost_panel = columns.get('cost_panel', base.cost_panel)
+    cost_frame = columns.get('cost_frame', base.cost_frame)
+
+    if not combos:
+        return
+
+    geometry_combos = itertools.product(*geometry.values())
+    skip = start % len(combos)
+    for g, values in enumerate(itertools.islice(geometry_combos, start // len(combos), None),
+                               start // len(combos)):
+        geometry_cfg = replace(base, **dict(zip(geometry, values)))
+        stack = Stack(geometry_cfg)
+
+        if roll or pitch or outline is not None:
+            panels = polygons.PolygonStack.from_stack(stack, roll, pitch, outline)
+            area = panels.exposed_area(grid.elevations, grid.azimuths)
+            total_area = panels.areas.sum()
+        else:
+            area = engine.exposed_area(stack, grid)
+            total_area = stack.total_panel_area
+        powers = grid.mean(engine.power_from_area(area, grid.irradiance, effs))[eff_index]
+        costs = engine.cost(total_area, stack.panel_width, cost_panel, cost_frame)
+        costs = np.broadcast_to(costs, powers.shape)
+
+        for i in range(skip, len(combos)):
+            cfg = replace(geometry_cfg, **dict(zip(scaling, combos[i])))
+            yield g * len(combos) + i, cfg, float(powers[i]), int(costs[i])
+        skip = 0
+
+
+def config_columns(base, expanded):
+    """every field as an array over all configs of the sweep (in sweep order), unswept fields stay scalars"""
+    columns = {name: getattr(base, name) for name in CONFIG_FIELDS}
+    if expanded:
+        mesh = np.meshgrid(*(np.asarray(values) for values in expanded.values()), indexing='ij')
+        columns.update({name: column.ravel() for name, column in zip(expanded, mesh)})
+    return columns
+
+
+def closed_form(base, ranges, grid):
+    """exact cost and an unshadowed power upper bound for every config, without any sun sweep
+
+    returns:
+        (cost, power_bound) arrays in sweep order. power_bound >= the average power
+        calc_power would report, since shadows only ever remove area
+    """
+    c = config_columns(base, expand_ranges(ranges))
+    area = engine.configs_panel_area(c)
+    cost = engine.cost(area, c['panel_width'], c['cost_panel'], c['cost_frame'])
+    # mean of truncated powers <= mean of untruncated ones, the margin covers float rounding
+    power_bound = area * engine.FT2_TO_M2 * c['eff'] * grid.mean(grid.irradiance) * (1 + 1e-9)
+    size = max(np.size(cost), np.size(power_bound), 1)
+    return np.broadcast_to(cost, size), np.broadcast_to(power_bound, size)
+
+
+def evaluate_pruned(base, ranges, grid, max_budget=None):
+    """yield (index, config, avg_power, cost) for the configs that can be on the budget/power frontier
+
+    configs are visited from cheapest to most expensive. a config over max_budget is
+    dropped, a config whose power bound is below the best power of a config
+    that costs no more is yielded with avg_power None instead of being evaluated,
+    it can never be the best choice at any budget.
+    """
+    expanded = expand_ranges(ranges)
+    cost, power_bound = closed_form(base, ranges, grid)
+    shape = [len(values) for values in expanded.values()]
+
+    candidates = np.arange(len(cost)) if max_budget is None else np.flatnonzero(cost <= max_budget)
+    best = -np.inf
+    for index in candidates[np.argsort(cost[candidates], kind='stable')]:
+        position = np.unravel_index(index, shape) if shape else ()
+        cfg = replace(base, **{name: values[i] for (name, values), i in zip(expanded.items(), position)})
+
+        if power_bound[index] < best:
+            yield int(index), cfg, None, int(cost[index])
+            continue
+
+        avg_power = float(engine.average_power(Stack(cfg), grid))
+        best = max(best, avg_power)
+        yield int(index), cfg, avg_power, int(cost[index])
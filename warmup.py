@@ -0,0 +1,102 @@
+"""Precompute the results behind the first requests so they are served from cache.
+
+Runs when the app is imported with SOLAR_STACK_WARMUP=1. With gunicorn
+`--preload` (see gunicorn.conf.py) it runs once in the master and every forked
+worker shares the warm caches, without preload each worker warms up before it
+starts accepting requests.
+
+    SOLAR_STACK_WARMUP=1                      warm up the layout defaults
+    SOLAR_STACK_WARMUP_BOAT_LENGTHS=30,36,44  also warm up these boat lengths
+    SOLAR_STACK_WARMUP_CONFIGS=fleet.json     also warm up a list of StackConfig field dicts
+"""
+import json
+import logging
+import os
+import time
+from dataclasses import replace
+
+import layout
+import plot_analysis
+from stack import Stack, StackConfig
+
+logger = logging.getLogger(__name__)
+
+# analysis page input id -> StackConfig field for the fixed parameters
+ANALYSIS_FIELDS = {
+    'boat-length-input-2': 'boat_length',
+    'base-mast-offset-input-2': 'base_mast_offset',
+    'base-panel-length-input-2': 'base_length',
+    'base-panel-height-input-2': 'base_height',
+    'cost-frame-input-2': 'cost_frame',
+    'cost-panel-input-2': 'cost_panel',
+    'eff-panel-input-2': 'eff',
+}
+
+
+def layout_defaults(component=layout.LAYOUT):
+    """collect the initial value of every input in the layout, keyed by component id"""
+    values = {}
+    if getattr(component, 'id', None) is not None and hasattr(component, 'value'):
+        values[component.id] = component.value
+
+    children = getattr(component, 'children', None)
+    if not isinstance(children, (list, tuple)):
+        children = [children]
+    for child in children:
+        if hasattr(child, 'to_plotly_json'):
+            values.update(layout_defaults(child))
+    return values
+
+
+def analysis_ranges(defaults):
+    """search ranges of the analysis page, as passed to create_budget_pow_fig"""
+    return dict(
+        num_range=(defaults['panel-num-min'], defaults['panel-num-max']),
+        width_range=(defaults['panel-width-min'], defaults['panel-width-max']),
+        spacing_range=(defaults['panel-spacing-min'], defaults['panel-spacing-max']),
+    )
+
+
+def configs_from_env(environ=os.environ):
+    """extra configs to warm up, from SOLAR_STACK_WARMUP_BOAT_LENGTHS and SOLAR_STACK_WARMUP_CONFIGS"""
+    configs = []
+    lengths = environ.get('SOLAR_STACK_WARMUP_BOAT_LENGTHS', '')
+    for length in filter(None, (s.strip() for s in lengths.split(','))):
+        configs.append(StackConfig(boat_length=float(length)))
+
+    path = environ.get('SOLAR_STACK_WARMUP_CONFIGS')
+    if path:
+        with open(path) as f:
+            configs.extend(StackConfig(**fields) for fields in json.load(f))
+    return configs
+
+
+def warm_up(configs=(), analysis_settings=None):
+    """precompute heatmap grids and budget sweeps for the defaults and the given configs
+
+    args:
+        configs: extra StackConfigs (e.g. the fleet's boat sizes), the defaults are always included
+        analysis_settings: fixed create_budget_pow_fig kwargs used by the analysis page
+            (steps and sun ranges), the budget sweeps are skipped when None
+
+    returns:
+        number of results computed
+    """
+    start = time.perf_counter()
+    count = 0
+
+    for cfg in [StackConfig()] + list(configs):
+        plot_analysis.create_heatmap(Stack(cfg))
+        count += 1
+
+    if analysis_settings is not None:
+        defaults = layout_defaults()
+        page_default = replace(StackConfig(), **{field: defaults[input_id]
+                                                 for input_id, field in ANALYSIS_FIELDS.items()})
+        for cfg in [page_default] + list(configs):
+            plot_analysis.create_budget_pow_fig(config=cfg, **analysis_ranges(defaults),
+                                                **analysis_settings)
+            count += 1
+
+    logger.info("warm-up computed %d results in %.2f s", count, time.perf_counter() - start)
+    return count